@@ -1,8 +1,14 @@
 import csv
 import os
+import sys
 from serpapi import GoogleSearch
 from dotenv import load_dotenv
 
+# Modules shared by all work folders
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'shared'))
+
+from url_index import UrlIndex
+
 load_dotenv()
 api_key = os.getenv('SERPAPI_KEY')
 
@@ -62,8 +68,14 @@ if __name__ == "__main__":
         "web_based_email", "web_chat", "web_hosting"
     ]
 
+    # Results found under an earlier query are not saved again, all categories of a page are kept in the index
+    url_index = UrlIndex('url_index.sqlite')
+
     for query in queries:
         print(f"Searching for: {query}")
-        search_results = search_google(query)
+        search_results = [result for result in search_google(query)
+                          if result.get('link') and url_index.add(result['link'], query, source='serpapi')[1]]
         save_to_csv(search_results, query)
         print(f"{len(search_results)} results for '{query}' saved to CSV.")
+
+    url_index.close()
@@ -0,0 +1,110 @@
+import gzip
+import ipaddress
+import os
+import sys
+import numpy as np
+
+
+# Opening plain or gzipped dump files
+def open_text(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    return open(path, 'r', encoding='utf-8', errors='replace')
+
+
+# iptoasn.com ip2asn-v4.tsv: range_start, range_end, AS_number, country, description (AS 0 = not routed)
+def read_iptoasn(path):
+    with open_text(path) as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 3 or ':' in fields[0]:
+                continue
+            asn = int(fields[2])
+            if asn:
+                yield int(ipaddress.IPv4Address(fields[0])), int(ipaddress.IPv4Address(fields[1])), asn
+
+
+# RouteViews pfx2as: prefix, length, AS (multi-origin entries like "13335_209242" keep the first AS)
+def read_pfx2as(path):
+    with open_text(path) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 3 or ':' in fields[0]:
+                continue
+            network = ipaddress.IPv4Network(f"{fields[0]}/{fields[1]}", strict=False)
+            asn = int(fields[2].replace(',', '_').split('_')[0])
+            yield int(network.network_address), int(network.broadcast_address), asn
+
+
+# Turning (possibly nested) ranges into sorted, non-overlapping ones, the most specific range wins
+def flatten_ranges(ranges):
+    segments = []
+
+    def emit(start, end, asn):
+        if start > end:
+            return
+        if segments and segments[-1][2] == asn and segments[-1][1] + 1 == start:
+            segments[-1][1] = end
+        else:
+            segments.append([start, end, asn])
+
+    stack = []
+    position = 0
+    for start, end, asn in sorted(ranges, key=lambda r: (r[0], -r[1])):
+        while stack and stack[-1][1] < start:
+            top = stack.pop()
+            emit(position, top[1], top[2])
+            position = max(position, top[1] + 1)
+        if stack:
+            emit(position, start - 1, stack[-1][2])
+        stack.append((start, end, asn))
+        position = start
+    while stack:
+        top = stack.pop()
+        emit(position, top[1], top[2])
+        position = max(position, top[1] + 1)
+    return segments
+
+
+# Writing the index as three uint32 .npy arrays (starts, ends, asns) into a directory
+def build_index(dump_path, index_directory):
+    reader = read_pfx2as if 'pfx2as' in os.path.basename(dump_path) else read_iptoasn
+    segments = flatten_ranges(reader(dump_path))
+    table = np.array(segments, dtype=np.uint32).reshape(-1, 3)
+    os.makedirs(index_directory, exist_ok=True)
+    np.save(os.path.join(index_directory, 'starts.npy'), np.ascontiguousarray(table[:, 0]))
+    np.save(os.path.join(index_directory, 'ends.npy'), np.ascontiguousarray(table[:, 1]))
+    np.save(os.path.join(index_directory, 'asns.npy'), np.ascontiguousarray(table[:, 2]))
+    return len(table)
+
+
+# Memory-mapped IP -> ASN lookups with binary search over the range starts
+class AsnIndex:
+    def __init__(self, index_directory):
+        self.starts = np.load(os.path.join(index_directory, 'starts.npy'), mmap_mode='r')
+        self.ends = np.load(os.path.join(index_directory, 'ends.npy'), mmap_mode='r')
+        self.asns = np.load(os.path.join(index_directory, 'asns.npy'), mmap_mode='r')
+
+    # ASN of an IPv4 address as a string (like "16509"), None when the address is not routed
+    def lookup(self, ip_address):
+        try:
+            ip = int(ipaddress.IPv4Address(ip_address))
+        except ValueError:
+            return None
+        i = int(np.searchsorted(self.starts, ip, side='right')) - 1
+        if i >= 0 and ip <= self.ends[i]:
+            return str(int(self.asns[i]))
+        return None
+
+    # ASNs of many addresses at once (0 = not found)
+    def lookup_many(self, ip_addresses):
+        ips = np.array([int(ipaddress.IPv4Address(ip)) for ip in ip_addresses], dtype=np.uint32)
+        i = np.searchsorted(self.starts, ips, side='right') - 1
+        found = (i >= 0) & (ips <= self.ends[np.maximum(i, 0)])
+        return np.where(found, self.asns[np.maximum(i, 0)], 0)
+
+
+if __name__ == "__main__":
+    # python asn_index.py ip2asn-v4.tsv.gz asn_index
+    count = build_index(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else 'asn_index')
+    print(f"ASN index with {count} ranges has been saved.")
@@ -1,23 +1,32 @@
 import csv
+import sys
 import time
 import requests
-from bs4 import BeautifulSoup
 import socket
+import os
 import certifi
 
+# Modules shared by all work folders
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'shared'))
 
-def has_ssl(url):
-    try:
-        response = requests.get(url, timeout=5, verify=certifi.where())
-        return response.url.startswith("https")
-    except requests.exceptions.RequestException:
-        return None
+from page_snapshot import fetch_snapshot
+from asn_index import AsnIndex
+
+# Local IP -> ASN index built with asn_index.py from an iptoasn/routeviews dump
+asn_index_directory = 'asn_index'
+# Asking ipinfo.io only for addresses which are not in the local index
+use_ipinfo_fallback = False
+
+asn_index = AsnIndex(asn_index_directory) if os.path.isdir(asn_index_directory) else None
 
 
-def get_page_length_and_links(url):
+def has_ssl(snapshot):
+    return snapshot.url.startswith("https")
+
+
+def get_page_length_and_links(snapshot):
     try:
-        response = requests.get(url, verify=certifi.where())
-        soup = BeautifulSoup(response.text, 'html.parser')
+        soup = snapshot.soup
         page_length = len(soup.get_text())
         link_count = len(soup.find_all('a'))
         return page_length, link_count
@@ -25,20 +34,18 @@ def get_page_length_and_links(url):
         return None, None
 
 
-def get_image_count(url):
+def get_image_count(snapshot):
     try:
-        response = requests.get(url, verify=certifi.where())
-        soup = BeautifulSoup(response.text, 'html.parser')
+        soup = snapshot.soup
         image_count = len(soup.find_all('img'))
         return image_count
     except Exception:
         return None
 
 
-def get_video_count(url):
+def get_video_count(snapshot):
     try:
-        response = requests.get(url, verify=certifi.where())
-        soup = BeautifulSoup(response.text, 'html.parser')
+        soup = snapshot.soup
         video_count = len(soup.find_all('video')) + len(soup.find_all('iframe'))
         return video_count
     except Exception:
@@ -53,7 +60,15 @@ def get_ip_address(domain):
         return None
 
 
-def get_hosting_info(ip_address, retries=2, wait_time=2):
+def get_hosting_info(ip_address):
+    if asn_index is not None:
+        asn_number = asn_index.lookup(ip_address)
+        if asn_number or not use_ipinfo_fallback:
+            return asn_number
+    return get_hosting_info_from_ipinfo(ip_address)
+
+
+def get_hosting_info_from_ipinfo(ip_address, retries=2, wait_time=2):
     attempt = 0
     while attempt < retries:
         try:
@@ -97,14 +112,22 @@ def update_csv(file_name="results_3.csv"):
             else:
                 hosting_org = None
 
-            ssl_status = has_ssl(url)
-            if ssl_status is not None:
-                row['ssl_certificate'] = int(ssl_status)
+            # Downloading the page once for all page features
+            try:
+                snapshot = fetch_snapshot(url, timeout=10, verify=certifi.where())
+            except requests.exceptions.RequestException:
+                snapshot = None
+
+            if snapshot is not None:
+                row['ssl_certificate'] = int(has_ssl(snapshot))
+                row['page_length'], row['link_count'] = get_page_length_and_links(snapshot)
+                row['image_count'] = get_image_count(snapshot)
+                row['video_count'] = get_video_count(snapshot)
             else:
                 row['ssl_certificate'] = "N/A"
-            row['page_length'], row['link_count'] = get_page_length_and_links(url)
-            row['image_count'] = get_image_count(url)
-            row['video_count'] = get_video_count(url)
+                row['page_length'], row['link_count'] = None, None
+                row['image_count'] = None
+                row['video_count'] = None
             row['hosting_org'] = hosting_org
 
             writer.writerow(row)
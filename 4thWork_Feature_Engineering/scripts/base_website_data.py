@@ -1,14 +1,27 @@
-import requests
 import csv
+import hashlib
 import os
-from bs4 import BeautifulSoup
+import json
+import sys
+import threading
+import time
+import concurrent.futures
+from urllib.parse import quote, urlsplit
 from dotenv import load_dotenv
 
+# Modules shared by all work folders
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'shared'))
+
+import http_session
+from page_snapshot import fetch_snapshot
+from url_index import UrlIndex
+
 load_dotenv()
 
-# Bing API info
+# Bing API info (BING_SEARCH_URL can point to the stand-in endpoint of stand_in_bing.py)
 subscription_key = os.getenv('SUBSCRIPTION_KEY')
-search_url = "https://api.bing.microsoft.com/v7.0/search"
+default_search_url = "https://api.bing.microsoft.com/v7.0/search"
+search_url = os.getenv('BING_SEARCH_URL', default_search_url)
 
 # query list
 queries = [
@@ -38,24 +51,84 @@ csv_file = os.path.join(data_directory, "bing_search_results200.csv")
 # CSV column values
 headers = ['Language', 'Category', 'URL', 'Title', 'Meta_Description']
 
+# Result pages of every query (50 results each, 200 in total)
+offsets = [0, 50, 100, 150]
+
+# API calls at the same time and per second (keep them within the subscription's quota),
+# metadata of the results is fetched by its own, larger pool while further result pages are requested
+api_workers = 3
+api_rate = 3.0
+metadata_workers = 50
+
+# Answers of the API are kept in ../data/bing_cache, so a rerun does not call the API again. Every search
+# endpoint has its own folder (answers of the stand-in are never replayed for the real API).
+# offline_mode only reads from this cache
+api_cache_directory = os.path.join(data_directory, 'bing_cache')
+use_api_cache = True
+offline_mode = False
+
+# Index of canonical URLs: a page found under several queries is downloaded once and written once per query
+# (one row per URL and category, whichever search finishes first) and metadata fetched in an earlier run is
+# taken from the index
+use_url_index = True
+
+_api_lock = threading.Lock()
+_next_api_call = 0.0
+
+
+# Spacing the API calls to api_rate per second
+def wait_for_api_turn():
+    global _next_api_call
+    with _api_lock:
+        now = time.monotonic()
+        start = max(now, _next_api_call)
+        _next_api_call = start + 1.0 / api_rate
+    if start > now:
+        time.sleep(start - now)
+
+
+# Cache folder of a search endpoint: its host and a hash of the whole URL
+def api_cache_folder(endpoint):
+    digest = hashlib.blake2b(endpoint.encode('utf-8'), digest_size=6).hexdigest()
+    return os.path.join(api_cache_directory, f"{urlsplit(endpoint).hostname or 'endpoint'}_{digest}")
+
+
+def api_cache_path(query, count, offset, endpoint=None):
+    return os.path.join(api_cache_folder(endpoint or search_url), f"{quote(query, safe='')}_{offset}_{count}.json")
+
+
 # Bing Web Search via API
 def bing_search(query, subscription_key, search_url, count=50, offset=0):
+    path = api_cache_path(query, count, offset, search_url)
+    if use_api_cache and os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    if offline_mode:
+        raise FileNotFoundError(f"No cached API answer for {query} with offset {offset}")
+
     headers = {"Ocp-Apim-Subscription-Key": subscription_key}
     params = {"q": query, "textDecorations": True, "textFormat": "HTML", "count": count, "offset": offset}
-    response = requests.get(search_url, headers=headers, params=params)
+    wait_for_api_turn()
+    response = http_session.get(search_url, headers=headers, params=params)
     response.raise_for_status()  # Hataları kontrol ediyoruz.
     search_results = response.json()
+
+    if use_api_cache:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(search_results, f)
+        os.replace(tmp_path, path)
     return search_results
 
 # Getting lang, meta desc. of the website
 def get_website_metadata(url):
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'}
-        response = requests.get(url, headers=headers, timeout=15)
-        response.raise_for_status()
+        # Streamed with a size cap, non-HTML answers are skipped before their body is downloaded
+        snapshot = fetch_snapshot(url, timeout=15)
+        snapshot.raise_for_status()
 
-        soup = BeautifulSoup(response.text, 'html.parser')
+        soup = snapshot.soup
 
         # Meta desc bulma
         meta_description = soup.find('meta', attrs={'name': 'description'})
@@ -70,35 +143,95 @@ def get_website_metadata(url):
         print(f"Error fetching metadata for {url}: {e}")
         return 'N/A', 'N/A'  # Sadece 2 değer döndürüyoruz
 
-# Writing to CSV
-with open(csv_file, mode='w', newline='', encoding='utf-8') as file:
-    writer = csv.writer(file)
-    writer.writerow(headers)
-
-    # Search for each query
-    for query in queries:
-        print(f"Searching for query: {query}")
-        total_results = 0
-
-        # İlk istekte 50 sonuç, diğerlerinde de 50 sonuç olmak üzere toplamda 200 sonuç
-        for offset in [0, 50, 100, 150]:
-            try:
-                results = bing_search(query, subscription_key, search_url, count=50, offset=offset)
-                web_pages = results.get("webPages", {}).get("value", [])
-
-                for result in web_pages:
-                    url = result.get("url", "No URL")
-                    title = result.get("name", "No title")
-
-                    # Getting meta info
-                    language_code, meta_description = get_website_metadata(url)
-
-                    writer.writerow([language_code, query, url, title, meta_description])
-                    total_results += 1
-
-            except Exception as e:
-                print(f"Error fetching results for {query} with offset {offset}: {e}")
-
-        print(f"Total results for '{query}': {total_results}")
 
-print(f"Search results have been saved to {csv_file}.")
+# Results of one page of a query as (url, title) pairs
+def search_page(query, offset):
+    results = bing_search(query, subscription_key, search_url, count=50, offset=offset)
+    web_pages = results.get("webPages", {}).get("value", [])
+    return [(result.get("url", "No URL"), result.get("name", "No title")) for result in web_pages]
+
+
+# CSV row of one search result (the metadata stage)
+def build_row(query, url, title):
+    # Getting meta info
+    language_code, meta_description = get_website_metadata(url)
+    return [language_code, query, url, title, meta_description]
+
+
+# Producer/consumer collection: result pages of all queries are requested by the API pool, every finished
+# page feeds its results to the metadata pool and the rows are written as soon as their metadata is there
+def collect(writer):
+    total_results = dict.fromkeys(queries, 0)
+    duplicates = 0
+    url_index = UrlIndex() if use_url_index else None
+    # (canonical url, query) pairs written in this run, and the results waiting for the metadata of their page
+    written = set()
+    waiting = {}
+    metadata_futures = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=api_workers) as search_pool, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=metadata_workers) as metadata_pool:
+        searches = {search_pool.submit(search_page, query, offset): (query, offset)
+                    for query in queries for offset in offsets}
+        pending = set(searches)
+
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                if future in searches:
+                    query, offset = searches.pop(future)
+                    try:
+                        web_pages = future.result()
+                    except Exception as e:
+                        print(f"Error fetching results for {query} with offset {offset}: {e}")
+                        continue
+                    for url, title in web_pages:
+                        if url_index is None:
+                            pending.add(metadata_pool.submit(build_row, query, url, title))
+                            continue
+                        canonical, first_in_run = url_index.add(url, query, source='bing')
+                        if not first_in_run:
+                            duplicates += 1
+                        if (canonical, query) in written:
+                            continue
+                        written.add((canonical, query))
+                        found, metadata = url_index.get_record(url, 'metadata')
+                        if found:
+                            language_code, meta_description = metadata
+                            writer.writerow([language_code, query, url, title, meta_description])
+                            total_results[query] += 1
+                        elif canonical in waiting:
+                            # The page is already being downloaded for another query
+                            waiting[canonical].append((query, url, title))
+                        else:
+                            waiting[canonical] = [(query, url, title)]
+                            future = metadata_pool.submit(get_website_metadata, url)
+                            metadata_futures[future] = canonical
+                            pending.add(future)
+                elif future in metadata_futures:
+                    language_code, meta_description = future.result()
+                    for query, url, title in waiting.pop(metadata_futures.pop(future)):
+                        writer.writerow([language_code, query, url, title, meta_description])
+                        total_results[query] += 1
+                    url_index.put_record(url, 'metadata', [language_code, meta_description])
+                else:
+                    row = future.result()
+                    writer.writerow(row)
+                    total_results[row[1]] += 1
+                    if url_index is not None:
+                        url_index.put_record(row[2], 'metadata', [row[0], row[4]])
+
+    if url_index is not None:
+        url_index.close()
+    for query, count in total_results.items():
+        print(f"Total results for '{query}': {count}")
+    print(f"{duplicates} results were already found under another query (their pages were downloaded once).")
+
+
+if __name__ == "__main__":
+    # Writing to CSV
+    with open(csv_file, mode='w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(headers)
+        collect(writer)
+
+    print(f"Search results have been saved to {csv_file}.")
@@ -1,12 +1,23 @@
 import json
-import csv
 import os
 import re
+import itertools
+import sys
 from collections import defaultdict
+import numpy as np
+
+# Modules shared by all work folders
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'shared'))
+
+from columnar import open_rows, open_writer
 
 data_directory = '../data'
 input_csv_file = os.path.join(data_directory, "website_content_analysis201.csv")
 output_csv_file = os.path.join(data_directory, "keyword_frequency_analysis200.csv")
+# Both may also be columnar tables (paths ending with .table, see columnar.py)
+
+# Rows processed together, category counts of a chunk are computed as one NumPy block
+chunk_size = 10000
 
 # JSON files' paths
 json_files = {
@@ -15,23 +26,78 @@ json_files = {
     'tr': os.path.join(data_directory, 'keywords_tr.json')
 }
 
+word_pattern = re.compile(r'\w+')
+
+
+def is_word_char(char):
+    return char.isalnum() or char == '_'
+
+
+# Compiled keyword matcher of one language, built once at load time.
+# The text is scanned once: every word is looked up among the keywords starting with it, so the counts
+# are the same as len(re.findall(r'\b' + re.escape(keyword) + r'\b', text)) for each keyword
+class KeywordCounter:
+    def __init__(self, categories, category_keywords):
+        self.keywords = []
+        self._first_words = defaultdict(list)
+        self._fallback = []
+        # Keyword x category incidence matrix (a keyword may appear in more than one category)
+        rows = []
+        for category, words_list in category_keywords.items():
+            for keyword in words_list:
+                keyword = keyword.lower()
+                if keyword not in self.keywords:
+                    self.keywords.append(keyword)
+                    rows.append(np.zeros(len(categories), dtype=np.int32))
+                rows[self.keywords.index(keyword)][categories.index(category)] += 1
+        self.incidence = np.array(rows, dtype=np.int32).reshape(len(self.keywords), len(categories))
+
+        for index, keyword in enumerate(self.keywords):
+            first_word = word_pattern.match(keyword)
+            if first_word and is_word_char(keyword[-1]):
+                self._first_words[first_word.group()].append((index, keyword))
+            else:
+                self._fallback.append((index, re.compile(r'\b' + re.escape(keyword) + r'\b')))
+
+    # Adding the keyword hits of a text to hits (one value per keyword)
+    def add_hits(self, text, hits):
+        text = text.lower()
+        last_end = {}
+        for word in word_pattern.finditer(text):
+            candidates = self._first_words.get(word.group())
+            if not candidates:
+                continue
+            start = word.start()
+            for index, keyword in candidates:
+                end = start + len(keyword)
+                if start < last_end.get(index, 0) or not text.startswith(keyword, start):
+                    continue
+                if end < len(text) and is_word_char(text[end]):
+                    continue
+                hits[index] += 1
+                last_end[index] = end
+        for index, pattern in self._fallback:
+            hits[index] += len(pattern.findall(text))
+
+
 # Getting keywords from JSON files
 keywords = {}
 for lang, json_file in json_files.items():
     with open(json_file, 'r', encoding='utf-8') as f:
         keywords[lang] = json.load(f)
 
+# Adding values of category to headers as features
+keyword_headers = sorted(set(keyword for lang_keywords in keywords.values() for keyword in lang_keywords))
+
+# One compiled matcher per language
+counters = {lang: KeywordCounter(keyword_headers, lang_keywords) for lang, lang_keywords in keywords.items()}
 
-# Counting keywords
-def count_keyword_occurrences(text, keywords):
-    counts = defaultdict(int)
-    text = text.lower()
-    # Her bir kategori değeri için JSON içerisindeki kategoriler içerisinde yer alan keyword listesi kullanılarak arama yapılması.
-    for category, words_list in keywords.items():
-        for keyword in words_list:
-            # Control of matching keyword/text
-            counts[category] += len(re.findall(r'\b' + re.escape(keyword.lower()) + r'\b', text))
-    return counts
+
+# Counting keywords of one text (category -> count)
+def count_keyword_occurrences(text, counter):
+    hits = np.zeros(len(counter.keywords), dtype=np.int32)
+    counter.add_hits(text, hits)
+    return dict(zip(keyword_headers, (hits @ counter.incidence).tolist()))
 
 
 # Normalizing lang code
@@ -43,47 +109,48 @@ def normalize_language_code(lang_code):
     return normalized_code if normalized_code in keywords else None
 
 
-# Reading existing file and writing a new.
-with open(input_csv_file, mode='r', newline='', encoding='utf-8') as infile, \
-        open(output_csv_file, mode='w', newline='', encoding='utf-8') as outfile:
-    reader = csv.DictReader(infile)
-    # Getting existing headers
-    base_headers = reader.fieldnames
-    # Adding values of category to headers as features
-    keyword_headers = sorted(set(keyword for lang_keywords in keywords.values() for keyword in lang_keywords))
-    # Creating final headers
-    headers = base_headers + keyword_headers
-    writer = csv.DictWriter(outfile, fieldnames=headers)
-    writer.writeheader()
-
-    for row in reader:
-        url = row['URL']
-        title = row['Title']
-        meta_description = row['Meta_Description']
-        language_code = row['Language']
-
-        normalized_lang_code = normalize_language_code(language_code)
-
-        # Getting keywords for URL-Lang.
-        if normalized_lang_code in keywords:
-            lang_keywords = keywords[normalized_lang_code]
-        else:
-            print(f"Language code {language_code} not recognized after normalization. Skipping...")
+# Category counts of URL+Title+Meta_Desc. for a chunk of rows as an (rows x categories) NumPy block
+def count_chunk(rows, languages):
+    block = np.zeros((len(rows), len(keyword_headers)), dtype=np.int32)
+    for lang, counter in counters.items():
+        indices = [i for i, row_lang in enumerate(languages) if row_lang == lang]
+        if not indices:
             continue
-
-        # Counting keywords density for each URL+Title+Meta_Desc.
-        url_counts = count_keyword_occurrences(url, lang_keywords)
-        title_counts = count_keyword_occurrences(title, lang_keywords)
-        meta_counts = count_keyword_occurrences(meta_description, lang_keywords)
-
-        total_counts = defaultdict(int)
-        for category in lang_keywords.keys():
-            total_counts[category] = url_counts[category] + title_counts[category] + meta_counts[category]
-
-        # Adding counts to current row
-        for category in keyword_headers:
-            row[category] = total_counts[category]
-
-        writer.writerow(row)
-
-print(f"Keyword frequency analysis has been saved to {output_csv_file}.")
+        hits = np.zeros((len(indices), len(counter.keywords)), dtype=np.int32)
+        for hit_row, i in zip(hits, indices):
+            row = rows[i]
+            counter.add_hits(row['URL'], hit_row)
+            counter.add_hits(row['Title'], hit_row)
+            counter.add_hits(row['Meta_Description'], hit_row)
+        block[indices] = hits @ counter.incidence
+    return block
+
+
+if __name__ == "__main__":
+    # Reading existing file and writing a new one chunk by chunk.
+    with open_rows(input_csv_file) as (base_headers, reader), \
+            open_writer(output_csv_file, base_headers + keyword_headers) as writer:
+        while True:
+            chunk = list(itertools.islice(reader, chunk_size))
+            if not chunk:
+                break
+
+            # Getting keywords for URL-Lang.
+            rows = []
+            languages = []
+            for row in chunk:
+                normalized_lang_code = normalize_language_code(row['Language'])
+                if normalized_lang_code not in keywords:
+                    print(f"Language code {row['Language']} not recognized after normalization. Skipping...")
+                    continue
+                rows.append(row)
+                languages.append(normalized_lang_code)
+
+            # Counting keywords density for each URL+Title+Meta_Desc.
+            block = count_chunk(rows, languages)
+
+            # Adding counts to current rows
+            for row, counts in zip(rows, block.tolist()):
+                writer.writerow([row[header] for header in base_headers] + counts)
+
+    print(f"Keyword frequency analysis has been saved to {output_csv_file}.")
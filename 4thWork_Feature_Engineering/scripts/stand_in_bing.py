@@ -0,0 +1,80 @@
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlsplit
+
+from base_website_data import api_cache_folder, default_search_url
+
+# Answers of the real API cached by base_website_data.py are replayed from here, other queries get generated
+# results (the stand-in's own answers are cached in another folder, see api_cache_folder)
+api_cache_directory = api_cache_folder(default_search_url)
+
+
+# Stand-in for the Bing Web Search endpoint and for the pages of its results, for trying the
+# collector without an API key or network: BING_SEARCH_URL=http://127.0.0.1:8001/v7.0/search
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    latency = 0.1
+    cache_directory = api_cache_directory
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        parts = urlsplit(self.path)
+        if parts.path == '/v7.0/search':
+            params = parse_qs(parts.query)
+            query = params.get('q', [''])[0]
+            count = int(params.get('count', ['50'])[0])
+            offset = int(params.get('offset', ['0'])[0])
+            self.send_body(200, 'application/json', json.dumps(self.search(query, count, offset)))
+        elif parts.path.startswith('/page/'):
+            name = parts.path[len('/page/'):]
+            self.send_body(200, 'text/html; charset=utf-8',
+                           f'<html lang="en"><head><title>{name}</title>'
+                           f'<meta name="description" content="Stand-in page {name}"></head>'
+                           f'<body><p>{name}</p></body></html>')
+        else:
+            self.send_body(404, 'text/plain', 'Not found')
+
+    def search(self, query, count, offset):
+        path = os.path.join(self.cache_directory, f"{quote(query, safe='')}_{offset}_{count}.json")
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        host = f"http://{self.headers.get('Host')}"
+        return {'webPages': {'value': [{'url': f"{host}/page/{quote(query)}-{offset + i}",
+                                        'name': f"{query} result {offset + i}"} for i in range(count)]}}
+
+    def send_body(self, status, content_type, body):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServer(ThreadingHTTPServer):
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+def make_server(host='127.0.0.1', port=8001, latency=0.1, cache_directory=api_cache_directory):
+    handler = type('Handler', (StandInHandler,), {'latency': latency, 'cache_directory': cache_directory})
+    return StandInServer((host, port), handler)
+
+
+# Starting the server in a daemon thread, returns the bound port (port=0 picks a free one)
+def start_in_thread(host='127.0.0.1', port=0, latency=0.1, cache_directory=api_cache_directory):
+    server = make_server(host, port, latency, cache_directory)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.server_address[1]
+
+
+if __name__ == "__main__":
+    print("Stand-in Bing endpoint listening on http://127.0.0.1:8001/v7.0/search")
+    make_server().serve_forever()
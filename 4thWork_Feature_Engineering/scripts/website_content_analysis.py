@@ -1,10 +1,14 @@
-import requests
-from bs4 import BeautifulSoup
 import csv
 import os
-import whois
+import sys
 from datetime import datetime
 
+# Modules shared by all work folders
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'shared'))
+
+from page_snapshot import PageSnapshot, UnwantedContentError, fetch_snapshot
+from whois_cache import WhoisCache, WhoisLane
+
 data_directory = '../data'
 input_csv_file = os.path.join(data_directory, "bing_search_results200.csv")
 output_csv_file = os.path.join(data_directory, "website_content_analysis201.csv")
@@ -16,14 +20,15 @@ new_headers = ['Word_Count', 'Link_Count', 'Image_Count', 'Video_Count', 'Has_Ad
 # Combining all headers
 headers = ['Language', 'Category', 'URL', 'Title', 'Meta_Description'] + new_headers
 
-# Getting Domain Age
-def get_domain_age(url):
+# WHOIS results cache (per registered domain) and the rate-limited WHOIS lane
+whois_cache_file = os.path.join(data_directory, "whois_cache.sqlite")
+whois_lane = WhoisLane(WhoisCache(whois_cache_file), workers=2, rate=2.0)
+
+# Getting Domain Age (from a lookup submitted to the WHOIS lane)
+def get_domain_age(url, creation_date_future):
     try:
-        domain_info = whois.whois(url)
-        creation_date = domain_info.creation_date
+        creation_date = creation_date_future.result()
         if creation_date:
-            if isinstance(creation_date, list):
-                creation_date = creation_date[0]  # Bazı domainler için birden fazla creation date olabilir
             age = (datetime.now() - creation_date).days // 365
             return age
         else:
@@ -33,28 +38,22 @@ def get_domain_age(url):
         return 'N/A'
 
 # Checking Payment
-def has_payment_system(url):
+def has_payment_system(snapshot):
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3' }
-        response = requests.get(url, headers=headers, timeout=10)
-        soup = BeautifulSoup(response.text, 'html.parser')
+        soup = snapshot.soup
         keywords = ['pay', 'credit card', 'checkout', 'payment']
         for keyword in keywords:
             if soup.find_all(string=lambda text: keyword in text.lower()):
                 return '1'
         return '0'
     except Exception as e:
-        print(f"Error checking payment system for {url}: {e}")
+        print(f"Error checking payment system for {snapshot.url}: {e}")
         return 'N/A'
 
 # Checking login
-def has_login(url):
+def has_login(snapshot):
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3' }
-        response = requests.get(url, headers=headers, timeout=10)
-        soup = BeautifulSoup(response.text, 'html.parser')
+        soup = snapshot.soup
         if soup.find('input', {'type': 'password'}):
             return '1'
         keywords = ['login', 'sign in', 'account']
@@ -63,46 +62,39 @@ def has_login(url):
                 return '1'
         return '0'
     except Exception as e:
-        print(f"Error checking login presence for {url}: {e}")
+        print(f"Error checking login presence for {snapshot.url}: {e}")
         return 'N/A'
 
 # Checking comments
-def has_user_comments(url):
+def has_user_comments(snapshot):
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3' }
-        response = requests.get(url, headers=headers, timeout=10)
-        soup = BeautifulSoup(response.text, 'html.parser')
+        soup = snapshot.soup
         keywords = ['comments', 'review', 'feedback']
         for keyword in keywords:
             if soup.find_all(string=lambda text: keyword in text.lower()):
                 return '1'
         return '0'
     except Exception as e:
-        print(f"Error checking user comments for {url}: {e}")
+        print(f"Error checking user comments for {snapshot.url}: {e}")
         return 'N/A'
 
 # Checking Cookies
-def has_cookies(url):
+def has_cookies(snapshot):
     try:
-        response = requests.get(url, timeout=10)
-        if 'set-cookie' in response.headers:
+        if 'set-cookie' in snapshot.headers:
             return '1'
         return '0'
     except Exception as e:
-        print(f"Error checking cookies for {url}: {e}")
+        print(f"Error checking cookies for {snapshot.url}: {e}")
         return 'N/A'
 
 # Checking Word_Count, Link_Count, Image_Count, Video_Count, Has_Ads, H1/H2_counts
-def analyze_website_content(url):
+def analyze_website_content(snapshot):
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3' }
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
+        snapshot.raise_for_status()
 
         # Getting content with BeautifulSoup
-        soup = BeautifulSoup(response.text, 'html.parser')
+        soup = snapshot.soup
 
         # Word Count
         text = soup.get_text()
@@ -128,7 +120,7 @@ def analyze_website_content(url):
         return word_count, link_count, image_count, video_count, has_ads, h1_count, h2_count
 
     except Exception as e:
-        print(f"Error analyzing {url}: {e}")
+        print(f"Error analyzing {snapshot.url}: {e}")
         return 'N/A', 'N/A', 'N/A', 'N/A', 'N/A', 'N/A', 'N/A'
 
 
@@ -143,12 +135,34 @@ with open(input_csv_file, mode='r', newline='', encoding='utf-8') as infile, \
     for row in reader:
         url = row['URL']
 
-        word_count, link_count, image_count, video_count, has_ads, h1_count, h2_count = analyze_website_content(url)
-        domain_age = get_domain_age(url)
-        payment_present = has_payment_system(url)
-        login_present = has_login(url)
-        user_comments = has_user_comments(url)
-        cookies_present = has_cookies(url)
+        # WHOIS runs in its own lane while the page is downloaded
+        creation_date_future = whois_lane.submit(url)
+
+        # Downloading the page once for all page features
+        headers_only = None
+        try:
+            snapshot = fetch_snapshot(url, timeout=10)
+        except UnwantedContentError as e:
+            print(f"Error fetching {url}: {e}")
+            snapshot = None
+            # Not a page, but its headers still tell whether cookies are set
+            headers_only = PageSnapshot(url, None, e.headers, b'')
+        except Exception as e:
+            print(f"Error fetching {url}: {e}")
+            snapshot = None
+
+        if snapshot is not None:
+            word_count, link_count, image_count, video_count, has_ads, h1_count, h2_count = analyze_website_content(snapshot)
+            payment_present = has_payment_system(snapshot)
+            login_present = has_login(snapshot)
+            user_comments = has_user_comments(snapshot)
+            cookies_present = has_cookies(snapshot)
+        else:
+            word_count, link_count, image_count, video_count, has_ads, h1_count, h2_count = ['N/A'] * 7
+            payment_present = login_present = user_comments = cookies_present = 'N/A'
+            if headers_only is not None:
+                cookies_present = has_cookies(headers_only)
+        domain_age = get_domain_age(url, creation_date_future)
 
         new_row = [
             row['Language'], row['Category'], row['URL'],
@@ -159,4 +173,5 @@ with open(input_csv_file, mode='r', newline='', encoding='utf-8') as infile, \
 
         writer.writerow(new_row)
 
+whois_lane.shutdown()
 print(f"Content analysis has been saved to {output_csv_file}.")
@@ -0,0 +1,246 @@
+import json
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+from model import CategoryModel, model_file
+
+# Requests are coalesced into one model call: a batch is closed when it has max_batch rows or when its
+# first request has waited max_wait seconds
+max_batch = 256
+max_wait = 0.005
+
+default_top_k = 3
+
+# Latencies kept for the percentiles
+latency_window = 10000
+
+# Seconds a request waits for its prediction before it is answered with 503
+result_timeout = 30
+
+
+# Feature rows queued by many request threads and scored in micro-batches by one worker thread
+class MicroBatcher:
+    def __init__(self, model, max_batch=max_batch, max_wait=max_wait):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._latencies = deque(maxlen=latency_window)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.batches = 0
+        self.started_at = time.perf_counter()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    # Future of the top k (category, probability) pairs of one raw feature row
+    def submit(self, row, top_k=default_top_k):
+        future = Future()
+        self._queue.put((self.model.features_of([row])[0], top_k, future, time.perf_counter()))
+        return future
+
+    def predict(self, row, top_k=default_top_k, timeout=None):
+        return self.submit(row, top_k).result(timeout)
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        if batch[0] is None:
+            return None
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                probabilities = self.model.scaled_predict_proba(np.stack([item[0] for item in batch]))
+            except Exception as e:
+                for _, _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            finished = time.perf_counter()
+            for (_, top_k, future, queued_at), row in zip(batch, probabilities):
+                best = np.argsort(-row)[:top_k]
+                future.set_result([(self.model.classes[i], float(row[i])) for i in best])
+            with self._lock:
+                self.requests += len(batch)
+                self.batches += 1
+                self._latencies.extend(finished - item[3] for item in batch)
+
+    # p50/p99 latency (ms, queueing included) of the last requests, throughput and mean batch size
+    def stats(self):
+        with self._lock:
+            latencies = np.array(self._latencies) * 1000
+            requests, batches = self.requests, self.batches
+        elapsed = time.perf_counter() - self.started_at
+        return {'requests': requests, 'batches': batches,
+                'mean_batch': round(requests / batches, 1) if batches else 0,
+                'p50_ms': round(float(np.percentile(latencies, 50)), 2) if len(latencies) else None,
+                'p99_ms': round(float(np.percentile(latencies, 99)), 2) if len(latencies) else None,
+                'throughput_rps': round(requests / elapsed, 1) if elapsed else 0}
+
+    def reset_stats(self):
+        with self._lock:
+            self._latencies.clear()
+            self.requests = self.batches = 0
+            self.started_at = time.perf_counter()
+
+    def close(self):
+        self._queue.put(None)
+        self._worker.join()
+
+
+# POST /predict {"features": {...} or [...], "top_k": 3} -> {"categories": [[category, probability], ...]}
+# POST /predict {"rows": [...], "top_k": 3} -> {"categories": [[...], ...]}
+# GET /stats -> latency percentiles and throughput
+class InferenceHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path.split('?')[0] == '/stats':
+            self.send_json(200, self.server.batcher.stats())
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path.split('?')[0] != '/predict':
+            self.send_json(404, {'error': 'not found'})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            if not isinstance(request, dict):
+                raise TypeError("The request must be a JSON object")
+            top_k = int(request.get('top_k', default_top_k))
+            if 'rows' in request:
+                futures = [self.server.batcher.submit(row, top_k) for row in request['rows']]
+                self.send_json(200, {'categories': [future.result(result_timeout) for future in futures]})
+            else:
+                self.send_json(200, {'categories': self.server.batcher.predict(request['features'], top_k,
+                                                                               result_timeout)})
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_json(400, {'error': str(e)})
+        except FutureTimeoutError:
+            self.send_json(503, {'error': f"No prediction within {result_timeout}s"})
+        # Model errors (set on the futures by the batcher) and anything else still get an answer
+        except Exception as e:
+            self.send_json(500, {'error': repr(e)})
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class InferenceServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def make_server(host='127.0.0.1', port=8002, model_path=model_file, max_batch=max_batch, max_wait=max_wait):
+    server = InferenceServer((host, port), InferenceHandler)
+    # An exported .npz model is scored with NumPy, without TensorFlow (see numpy_model.py)
+    if model_path.endswith('.npz'):
+        from numpy_model import NumpyCategoryModel
+        model = NumpyCategoryModel(model_path)
+    else:
+        model = CategoryModel(model_path)
+    server.batcher = MicroBatcher(model, max_batch, max_wait)
+    return server
+
+
+def start_in_thread(host='127.0.0.1', port=0, model_path=model_file, max_batch=max_batch, max_wait=max_wait):
+    server = make_server(host, port, model_path, max_batch, max_wait)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def get_json(host, port, path):
+    import http.client
+    connection = http.client.HTTPConnection(host, port, timeout=30)
+    connection.request('GET', path)
+    data = json.loads(connection.getresponse().read())
+    connection.close()
+    return data
+
+
+# Load generator: `clients` keep-alive clients send `requests` single-row predictions with random feature
+# rows around the training mean (feature_mean/feature_scale of the schema); client-side and server-side
+# latency and throughput are returned
+def run_load(host, port, feature_mean, feature_scale, requests=2000, clients=32, top_k=default_top_k, seed=0):
+    import http.client
+
+    rng = np.random.default_rng(seed)
+    rows = (feature_mean + rng.standard_normal((min(requests, 1000), len(feature_mean))) * feature_scale).tolist()
+    latencies = []
+    lock = threading.Lock()
+
+    def client(count, offset):
+        connection = http.client.HTTPConnection(host, port, timeout=30)
+        mine = []
+        for i in range(count):
+            body = json.dumps({'features': rows[(offset + i) % len(rows)], 'top_k': top_k})
+            started = time.perf_counter()
+            connection.request('POST', '/predict', body, {'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            response.read()
+            if response.status != 200:
+                raise RuntimeError(f"Prediction failed with status {response.status}")
+            mine.append(time.perf_counter() - started)
+        connection.close()
+        with lock:
+            latencies.extend(mine)
+
+    per_client = [requests // clients + (1 if i < requests % clients else 0) for i in range(clients)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        for future in [executor.submit(client, count, i * 7) for i, count in enumerate(per_client)]:
+            future.result()
+    elapsed = time.perf_counter() - started
+    latencies = np.array(latencies) * 1000
+    return {'requests': requests, 'clients': clients, 'seconds': round(elapsed, 2),
+            'throughput_rps': round(requests / elapsed, 1),
+            'p50_ms': round(float(np.percentile(latencies, 50)), 2),
+            'p99_ms': round(float(np.percentile(latencies, 99)), 2),
+            'server': get_json(host, port, '/stats')}
+
+
+if __name__ == "__main__":
+    # python inference_server.py [serve] [port]            serving the model
+    # python inference_server.py load [requests] [clients]  load test against a server started in-process
+    command = sys.argv[1] if len(sys.argv) > 1 else 'serve'
+    if command == 'load':
+        server = start_in_thread()
+        host, port = server.server_address[:2]
+        model = server.batcher.model
+        print(json.dumps(run_load(host, port, model.mean, model.scale, *[int(value) for value in sys.argv[2:4]]),
+                         indent=2))
+        server.shutdown()
+        server.batcher.close()
+    else:
+        server = make_server(port=int(sys.argv[2]) if len(sys.argv) > 2 else 8002)
+        print(f"Serving {model_file} on http://{server.server_address[0]}:{server.server_address[1]}/predict")
+        server.serve_forever()
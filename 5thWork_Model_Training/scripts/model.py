@@ -1,19 +1,39 @@
-import numpy as np
+import json
 import os
-from tensorflow.keras.models import Sequential
-from tensorflow.keras.layers import Dense, Dropout, Input
-from tensorflow.keras.callbacks import EarlyStopping
-from tensorflow.keras.initializers import HeNormal
-from tensorflow.keras.regularizers import l1_l2
-from tensorflow.keras.optimizers import Adam
-from tensorflow.keras.utils import to_categorical
-from sklearn.preprocessing import LabelEncoder
-from preproccessing import target
-from plot_results import plot_confusion_matrix, plot_classification_report, plot_training_history
+import sys
+import numpy as np
+
+# Outputs of preproccessing.py
+data_directory = os.getcwd()
+schema_file = 'preprocessing.json'
+
+# The trained model, its schema (feature order, class names, scaler) is saved next to it
+model_file = 'website_category_model.keras'
+
+epochs = 50
+
+# 'arrays' trains on the whole .npy splits in memory, 'shards' streams the sharded records of
+# record_shards.py through tf.data (memory stays flat as the dataset grows)
+input_mode = 'arrays'
+
+
+def schema_path_for(model_path):
+    return os.path.splitext(model_path)[0] + '.json'
+
+
+def load_schema(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
 
 
 # Creating Model Func
 def create_model(input_shape, num_classes, dropout_rate=0.1, l1_reg=0.005, l2_reg=0.005):
+    from tensorflow.keras.models import Sequential
+    from tensorflow.keras.layers import Dense, Dropout, Input
+    from tensorflow.keras.initializers import HeNormal
+    from tensorflow.keras.regularizers import l1_l2
+    from tensorflow.keras.optimizers import Adam
+
     initializer = HeNormal()
     model = Sequential([
         Input(shape=(input_shape,)),
@@ -25,62 +45,160 @@ def create_model(input_shape, num_classes, dropout_rate=0.1, l1_reg=0.005, l2_re
     ])
 
     optimizer = Adam(learning_rate=0.005)
-    model.compile(optimizer=optimizer, loss='categorical_crossentropy', metrics=['accuracy'])
+    # Labels are class indexes, no one-hot matrix of rows x classes is built
+    model.compile(optimizer=optimizer, loss='sparse_categorical_crossentropy', metrics=['accuracy'])
     return model
 
-# Defining number of classes
-num_classes = len(target)
 
-# Preparing for Label Encoding
-label_encoder = LabelEncoder()
-label_encoder.fit(target)
+# Features and integer labels of one split ('train', 'val' or 'test'). Labels of older runs were saved as
+# pickled class names, they are converted to indexes of the class list
+def load_split(name, classes, directory=None):
+    directory = directory or data_directory
+    X = np.load(os.path.join(directory, f'X_{name}_scaled.npy'), mmap_mode='r')
+    try:
+        y = np.load(os.path.join(directory, f'y_{name}.npy'))
+    except ValueError:
+        names = np.load(os.path.join(directory, f'y_{name}.npy'), allow_pickle=True)
+        index = {category: i for i, category in enumerate(classes)}
+        y = np.array([index[category] for category in names], dtype=np.int32)
+    return X, y
 
-# Loading data
-current_directory = os.getcwd()
-X_train = np.load(os.path.join(current_directory, 'X_train_scaled.npy'))
-y_train = np.load(os.path.join(current_directory, 'y_train.npy'), allow_pickle=True)
-X_val = np.load(os.path.join(current_directory, 'X_val_scaled.npy'))
-y_val = np.load(os.path.join(current_directory, 'y_val.npy'), allow_pickle=True)
-X_test = np.load(os.path.join(current_directory, 'X_test_scaled.npy'))
-y_test = np.load(os.path.join(current_directory, 'y_test.npy'), allow_pickle=True)
 
 # Checking the target variables
-def check_labels(y):
+def check_labels(y, classes):
     unique_labels = np.unique(y)
-    print(f'Unique labels in y: {unique_labels}')
-
-check_labels(y_train)
-check_labels(y_val)
-check_labels(y_test)
-
-# Converting string labels to numeric labels
-y_train_encoded = label_encoder.transform(y_train)
-y_val_encoded = label_encoder.transform(y_val)
-y_test_encoded = label_encoder.transform(y_test)
-
-# Encode targets with one-hot encoding
-y_train_categorical = to_categorical(y_train_encoded, num_classes=num_classes)
-y_val_categorical = to_categorical(y_val_encoded, num_classes=num_classes)
-y_test_categorical = to_categorical(y_test_encoded, num_classes=num_classes)
-
-# Creating model
-model = create_model(X_train.shape[1], num_classes=num_classes)
-
-# Setting EarlyStopping
-early_stopping = EarlyStopping(monitor='val_loss', patience=10, restore_best_weights=True)
-
-# Train the model
-history = model.fit(X_train, y_train_categorical, epochs=50, validation_data=(X_val, y_val_categorical), callbacks=[early_stopping])
-
-# Save the model
-model.save('website_category_model.keras')
-
-# Evaluating performance at Test's dataset
-y_test_pred = model.predict(X_test)
-y_test_pred_classes = np.argmax(y_test_pred, axis=1)
-y_test_true_classes = np.argmax(y_test_categorical, axis=1)
-
-# Creating graphs for history, confusion_matrix and classification_report
-plot_training_history(history)
-plot_confusion_matrix(y_test_true_classes, y_test_pred_classes, label_encoder)
-plot_classification_report(y_test_true_classes, y_test_pred_classes, label_encoder)
+    print(f'Unique labels in y: {[classes[label] for label in unique_labels]}')
+
+
+# Training on the preprocessed splits, the model and its schema are saved; returns (model, history)
+def train(directory=None, model_path=model_file, epochs=epochs, input_mode=input_mode):
+    from tensorflow.keras.callbacks import EarlyStopping
+
+    directory = directory or data_directory
+    schema = load_schema(os.path.join(directory, schema_file))
+    classes = schema['classes']
+    # Defining number of classes
+    num_classes = len(classes)
+
+    # Setting EarlyStopping
+    early_stopping = EarlyStopping(monitor='val_loss', patience=10, restore_best_weights=True)
+
+    if input_mode == 'shards':
+        import record_shards
+        shards = os.path.join(directory, record_shards.shard_directory)
+        # Shards are (re)written when they are missing or older than the outputs of preproccessing.py
+        for split in ('train', 'val'):
+            if record_shards.shards_stale(split, directory, shards):
+                record_shards.write_shards(split, directory, shards)
+        train_data = record_shards.make_dataset('train', shards, training=True)
+        val_data = record_shards.make_dataset('val', shards, training=False)
+
+        # Creating model
+        model = create_model(len(schema['features']), num_classes=num_classes)
+
+        # Train the model
+        history = model.fit(train_data, epochs=epochs, validation_data=val_data, callbacks=[early_stopping])
+    else:
+        # Loading data
+        X_train, y_train = load_split('train', classes, directory)
+        X_val, y_val = load_split('val', classes, directory)
+        check_labels(y_train, classes)
+        check_labels(y_val, classes)
+
+        # Creating model
+        model = create_model(X_train.shape[1], num_classes=num_classes)
+
+        # Train the model
+        history = model.fit(np.asarray(X_train), y_train, epochs=epochs, validation_data=(np.asarray(X_val), y_val),
+                            callbacks=[early_stopping])
+
+    # Save the model
+    model.save(model_path)
+    with open(schema_path_for(model_path), 'w', encoding='utf-8') as f:
+        json.dump(schema, f, ensure_ascii=False)
+    return model, history
+
+
+# Evaluating performance at Test's dataset, with graphs for history, confusion_matrix and classification_report
+def evaluate(model=None, history=None, directory=None, model_path=model_file, plot=True):
+    from tensorflow.keras.models import load_model
+
+    directory = directory or data_directory
+    classes = load_schema(schema_path_for(model_path))['classes']
+    if model is None:
+        model = load_model(model_path)
+    X_test, y_test = load_split('test', classes, directory)
+    check_labels(y_test, classes)
+
+    y_test_pred = model.predict(np.asarray(X_test))
+    y_test_pred_classes = np.argmax(y_test_pred, axis=1)
+    accuracy = float(np.mean(y_test_pred_classes == y_test))
+    print(f'Test accuracy: {accuracy:.4f}')
+
+    if plot:
+        from plot_results import plot_confusion_matrix, plot_classification_report, plot_training_history
+        if history is not None:
+            plot_training_history(history)
+        plot_confusion_matrix(y_test, y_test_pred_classes, classes)
+        plot_classification_report(y_test, y_test_pred_classes, classes)
+    return accuracy
+
+
+# Model with its schema, loaded once for predict()
+class CategoryModel:
+    def __init__(self, model_path=model_file):
+        from tensorflow.keras.models import load_model
+
+        schema = load_schema(schema_path_for(model_path))
+        self.features = schema['features']
+        self.classes = schema['classes']
+        self.mean = np.array(schema['scaler_mean'], dtype=np.float32)
+        self.scale = np.array(schema['scaler_scale'], dtype=np.float32)
+        self.model = load_model(model_path)
+
+    # Raw feature rows (dicts by feature name or lists in schema order) as a scaled float32 matrix
+    def features_of(self, rows):
+        rows = [[row[feature] for feature in self.features] if isinstance(row, dict) else row for row in rows]
+        X = np.array(rows, dtype=np.float32).reshape(len(rows), len(self.features))
+        return (X - self.mean) / self.scale
+
+    # Probabilities of already scaled rows: one direct call of the model, without the batching and callback
+    # machinery of model.predict (the model is small, so that overhead dominates small batches)
+    def scaled_predict_proba(self, X):
+        return np.asarray(self.model(X, training=False))
+
+    def predict_proba(self, rows):
+        return self.scaled_predict_proba(self.features_of(rows))
+
+    # Top k (category, probability) pairs of every row
+    def predict(self, rows, top_k=1):
+        probabilities = self.predict_proba(rows)
+        best = np.argsort(-probabilities, axis=1)[:, :top_k]
+        return [[(self.classes[i], float(p[i])) for i in indexes] for p, indexes in zip(probabilities, best)]
+
+
+def predict(rows, model_path=model_file, top_k=1):
+    return CategoryModel(model_path).predict(rows, top_k)
+
+
+if __name__ == "__main__":
+    # python model.py [train [arrays|shards]]   training and evaluation (the default)
+    # python model.py evaluate                  evaluation of the saved model
+    # python model.py predict <csv>             categories of the feature rows of a CSV file
+    command = sys.argv[1] if len(sys.argv) > 1 else 'train'
+    if command == 'train':
+        model, history = train(input_mode=sys.argv[2] if len(sys.argv) > 2 else input_mode)
+        evaluate(model, history)
+    elif command == 'evaluate':
+        evaluate()
+    elif command == 'predict':
+        import csv
+        category_model = CategoryModel()
+        with open(sys.argv[2], mode='r', newline='', encoding='utf-8') as f:
+            # Rows with a missing feature are skipped, preprocessing drops them too
+            rows = [row for row in csv.DictReader(f)
+                    if all(row.get(feature) not in (None, '', 'N/A') for feature in category_model.features)]
+        for row, top in zip(rows, category_model.predict(rows, top_k=3)):
+            print(row.get('URL', ''), ', '.join(f'{category} ({probability:.2f})' for category, probability in top))
+    else:
+        print(f"Unknown command {command}, use train, evaluate or predict.")
@@ -0,0 +1,115 @@
+import sys
+import time
+import numpy as np
+
+from model import CategoryModel, load_schema, model_file, schema_path_for
+
+# The exported model: Dense weights, scaler and class names in one .npz file
+numpy_model_file = 'website_category_model.npz'
+
+# Storage precision of the weights: 'float32', 'float16' or 'int8' (symmetric, one scale per output unit).
+# The forward pass always runs in float32, smaller types only make the file smaller
+weight_dtype = 'float32'
+
+activations = {
+    'relu': lambda x: np.maximum(x, 0, out=x),
+    'linear': lambda x: x,
+}
+
+
+def softmax(x):
+    x = x - x.max(axis=1, keepdims=True)
+    np.exp(x, out=x)
+    x /= x.sum(axis=1, keepdims=True)
+    return x
+
+
+def quantize_int8(kernel):
+    scale = np.abs(kernel).max(axis=0) / 127
+    scale[scale == 0] = 1
+    return np.round(kernel / scale).astype(np.int8), scale.astype(np.float32)
+
+
+# Layers without any effect at inference, they are left out of the export
+skipped_layers = ('Dropout', 'InputLayer')
+
+
+# Writing the Dense layers of the Keras model with its schema. Any other layer (e.g. BatchNormalization)
+# would be lost by the NumPy forward pass, so the export fails instead
+def export(model_path=model_file, output_path=numpy_model_file, dtype=weight_dtype):
+    from tensorflow.keras.models import load_model
+
+    model = load_model(model_path)
+    schema = load_schema(schema_path_for(model_path))
+    arrays = {'mean': np.array(schema['scaler_mean'], dtype=np.float32),
+              'scale': np.array(schema['scaler_scale'], dtype=np.float32),
+              'classes': np.array(schema['classes'], dtype=str),
+              'features': np.array(schema['features'], dtype=str)}
+    layer_activations = []
+    for layer in model.layers:
+        kind = layer.__class__.__name__
+        if kind in skipped_layers:
+            continue
+        if kind != 'Dense':
+            raise ValueError(f"Layer {layer.name} ({kind}) of {model_path} cannot be exported, only Dense layers are")
+        activation = layer.get_config()['activation']
+        if activation != 'softmax' and activation not in activations:
+            raise ValueError(f"Activation {activation} of layer {layer.name} is not supported")
+        kernel, bias = layer.get_weights()
+        i = len(layer_activations)
+        if dtype == 'int8':
+            arrays[f'kernel_{i}'], arrays[f'kernel_scale_{i}'] = quantize_int8(kernel)
+        else:
+            arrays[f'kernel_{i}'] = kernel.astype(dtype)
+        arrays[f'bias_{i}'] = bias.astype(np.float32)
+        layer_activations.append(activation)
+    arrays['activations'] = np.array(layer_activations, dtype=str)
+    np.savez(output_path, **arrays)
+    return output_path
+
+
+# The same interface as CategoryModel (features_of, predict_proba, predict) without TensorFlow:
+# a batched forward pass of the exported weights in NumPy
+class NumpyCategoryModel(CategoryModel):
+    def __init__(self, path=numpy_model_file):
+        with np.load(path) as arrays:
+            self.features = arrays['features'].tolist()
+            self.classes = arrays['classes'].tolist()
+            self.mean = arrays['mean']
+            self.scale = arrays['scale']
+            self.layers = []
+            for i, activation in enumerate(arrays['activations'].tolist()):
+                kernel = arrays[f'kernel_{i}'].astype(np.float32)
+                if f'kernel_scale_{i}' in arrays:
+                    kernel *= arrays[f'kernel_scale_{i}']
+                self.layers.append((kernel, arrays[f'bias_{i}'], activation))
+
+    def scaled_predict_proba(self, X):
+        x = np.asarray(X, dtype=np.float32)
+        for kernel, bias, activation in self.layers:
+            x = x @ kernel
+            x += bias
+            x = softmax(x) if activation == 'softmax' else activations[activation](x)
+        return x
+
+
+# Largest absolute difference between the probabilities of model.predict and of the NumPy path on X
+def compare(X, model_path=model_file, path=numpy_model_file):
+    from tensorflow.keras.models import load_model
+
+    expected = load_model(model_path).predict(X, verbose=0)
+    return float(np.abs(NumpyCategoryModel(path).scaled_predict_proba(X) - expected).max())
+
+
+if __name__ == "__main__":
+    # python numpy_model.py [float32|float16|int8]   export and check against model.predict on the test split
+    dtype = sys.argv[1] if len(sys.argv) > 1 else weight_dtype
+    export(dtype=dtype)
+    started = time.perf_counter()
+    numpy_model = NumpyCategoryModel()
+    print(f"{numpy_model_file} ({dtype}) has been saved, loading it takes {(time.perf_counter() - started) * 1000:.1f} ms.")
+    X_test = np.load('X_test_scaled.npy', mmap_mode='r')[:10000].astype(np.float32)
+    difference = compare(X_test)
+    agreement = float(np.mean(np.argmax(numpy_model.scaled_predict_proba(X_test), axis=1) ==
+                              np.argmax(CategoryModel().scaled_predict_proba(X_test), axis=1)))
+    print(f"Max probability difference to model.predict: {difference:.2e}, same top class for {agreement:.2%}.")
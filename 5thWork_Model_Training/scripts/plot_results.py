@@ -26,11 +26,11 @@ def plot_training_history(history):
     plt.show()
 
 
-# Creating confusion matrix
-def plot_confusion_matrix(y_true, y_pred, label_encoder):
+# Creating confusion matrix (labels are indexes of classes)
+def plot_confusion_matrix(y_true, y_pred, classes):
     conf_matrix = confusion_matrix(y_true, y_pred)
-    predicted_labels = label_encoder.inverse_transform(np.unique(y_pred))
-    true_labels = label_encoder.inverse_transform(np.unique(y_true))
+    predicted_labels = np.asarray(classes)[np.unique(y_pred)]
+    true_labels = np.asarray(classes)[np.unique(y_true)]
 
     plt.figure(figsize=(12, 10))
     sns.heatmap(conf_matrix, annot=True, fmt='d', cmap='Blues', xticklabels=predicted_labels, yticklabels=true_labels)
@@ -41,8 +41,8 @@ def plot_confusion_matrix(y_true, y_pred, label_encoder):
 
 
 # Creating classification report
-def plot_classification_report(y_true, y_pred, label_encoder):
+def plot_classification_report(y_true, y_pred, classes):
     labels = np.unique(y_true)
     class_report = classification_report(y_true, y_pred, labels=labels,
-                                         target_names=label_encoder.inverse_transform(labels))
+                                         target_names=np.asarray(classes)[labels])
     print(class_report)
@@ -1,12 +1,36 @@
-import pandas as pd
-import numpy as np
-from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import StandardScaler
+import hashlib
+import json
 import os
+import sys
+import numpy as np
+
+# Modules shared by all work folders
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'shared'))
+
+from columnar import is_table, iter_chunks, na_values, read_table
+
+# Dataset: a CSV file or a columnar table (a path ending with .table, see columnar.py)
+data_file = '../data/data200.csv'  # Ensure the correct path to your dataset
+
+base_features = ['Word_Count', 'Link_Count', 'Image_Count', 'Video_Count', 'Has_Ads', 'Domain_Age',
+                 'Payment_Present', 'Login_Present', 'User_Comments', 'Cookies_Present', 'H1_Count', 'H2_Count']
 
-# Load the data
-data = pd.read_csv('../data/data200.csv')  # Ensure the correct path to your dataset
-data.dropna(inplace=True)
+# Text columns are only checked for missing values, they are not features
+text_columns = ['Language', 'URL', 'Title', 'Meta_Description']
+
+# Classes with fewer samples are removed
+min_samples_per_class = 2
+
+# Out-of-core mode for datasets which do not fit in memory: the data is read in chunks of chunk_rows rows
+# (twice) and the scaled features are float32 .npy files written through memory maps
+chunked = False
+chunk_rows = 100000
+# Train, validation and test shares of the chunked split
+split_fractions = (0.7, 0.15, 0.15)
+random_state = 42
+
+# Written next to the arrays: feature order, class names (labels are indexes into them) and scaler
+schema_file = 'preprocessing.json'
 
 # Additional features we want to add
 additional_features = ["abortion", "advertising", "advocacy_organizations", "alcohol", "alternative_beliefs",
@@ -27,52 +51,197 @@ additional_features = ["abortion", "advertising", "advocacy_organizations", "alc
         "streaming_media_and_download", "tobacco", "travel", "unrated", "weapons_sales", "web_based_applications",
         "web_based_email", "web_chat", "web_hosting"]
 
-# Define the Features and Target columns
-features = data[['Word_Count', 'Link_Count', 'Image_Count', 'Video_Count', 'Has_Ads', 'Domain_Age',
-                 'Payment_Present', 'Login_Present', 'User_Comments', 'Cookies_Present', 'H1_Count', 'H2_Count'] + additional_features]
+feature_columns = base_features + additional_features
+split_names = ['train', 'val', 'test']
 
-# Target: Category column
-target = data['Category']
 
-# Remove classes with insufficient samples
-min_samples_per_class = 2
-class_counts = target.value_counts()
-valid_classes = class_counts[class_counts >= min_samples_per_class].index
-
-# Filter data and target to only keep valid classes
-filtered_data = data[data['Category'].isin(valid_classes)]
-features = features.loc[filtered_data.index]  # Select rows only in valid indices
-target = filtered_data['Category']
-
-# First data split
-X_train, X_temp, y_train, y_temp = train_test_split(features, target, test_size=0.3, random_state=42, stratify=target)
-
-# Remove classes with insufficient samples from the temporary set (X_temp, y_temp)
-temp_class_counts = y_temp.value_counts()
-valid_temp_classes = temp_class_counts[temp_class_counts >= min_samples_per_class].index
-
-# Filter the temporary set to remove classes with insufficient samples
-X_temp = X_temp[y_temp.isin(valid_temp_classes)]
-y_temp = y_temp[y_temp.isin(valid_temp_classes)]
-
-# Second data split
-X_val, X_test, y_val, y_test = train_test_split(X_temp, y_temp, test_size=0.5, random_state=42, stratify=y_temp)
-
-# Scaling the data (Standard Scaler)
-scaler = StandardScaler()
-X_train_scaled = scaler.fit_transform(X_train)
-X_val_scaled = scaler.transform(X_val)
-X_test_scaled = scaler.transform(X_test)
-
-# Save the processed data in the current directory
-current_directory = os.getcwd()
-
-# Save the files with full path
-np.save(os.path.join(current_directory, 'X_train_scaled.npy'), X_train_scaled)
-np.save(os.path.join(current_directory, 'y_train.npy'), y_train)
-np.save(os.path.join(current_directory, 'X_val_scaled.npy'), X_val_scaled)
-np.save(os.path.join(current_directory, 'y_val.npy'), y_val)
-np.save(os.path.join(current_directory, 'X_test_scaled.npy'), X_test_scaled)
-np.save(os.path.join(current_directory, 'y_test.npy'), y_test)
-
-print("Data processing completed and saved.")
+# Chunks of the dataset (URL, Category and the features) without rows with missing values
+def read_chunks(data_file, chunk_rows=chunk_rows):
+    import pandas as pd
+
+    if is_table(data_file):
+        for chunk in iter_chunks(data_file, ['URL', 'Category'] + feature_columns,
+                                 filters=[(column, 'not in', list(na_values)) for column in text_columns]):
+            yield pd.DataFrame(chunk).dropna()
+    else:
+        for chunk in pd.read_csv(data_file, chunksize=chunk_rows):
+            yield chunk.dropna()[['URL', 'Category'] + feature_columns]
+
+
+# 64-bit hash of every URL: the split of a row depends only on its URL, not on the order or size of the data
+def split_keys(urls):
+    key = str(random_state).encode('utf-8')
+    return np.array([int.from_bytes(hashlib.blake2b(url.encode('utf-8'), digest_size=8, key=key).digest(), 'little')
+                     for url in urls], dtype=np.uint64)
+
+
+# Split of every row (0 train, 1 val, 2 test) from its key. Each class is split by the same shares, so the
+# split is stratified; the row with the smallest key of a class always goes to train, every class is trained on
+def assign_splits(keys, categories, first_keys=None):
+    position = keys.astype(np.float64) / 2.0 ** 64
+    splits = np.where(position < split_fractions[0], 0, np.where(position < split_fractions[0] + split_fractions[1], 1, 2))
+    if first_keys is not None:
+        firsts = np.array([first_keys.get(category) for category in categories], dtype=object) == keys.astype(object)
+        splits[firsts] = 0
+    return splits
+
+
+# Chunked preprocessing with a fixed memory budget (about chunk_rows rows at a time):
+# pass 1 counts the classes and the rows of every split, pass 2 fits the scaler on the train rows with
+# partial_fit while the raw features are written into memory-mapped outputs, which are scaled in place last
+def preprocess_chunked(data_file, output_directory):
+    import pandas as pd
+    from sklearn.preprocessing import StandardScaler
+
+    class_counts = {}
+    split_counts = {}
+    first_keys = {}
+    for chunk in read_chunks(data_file):
+        keys = split_keys(chunk['URL'])
+        splits = assign_splits(keys, chunk['Category'])
+        for category, key, split in zip(chunk['Category'].tolist(), keys.tolist(), splits.tolist()):
+            class_counts[category] = class_counts.get(category, 0) + 1
+            split_counts[(category, split)] = split_counts.get((category, split), 0) + 1
+            # Rows of a duplicated URL share its key, all of them are counted
+            if category not in first_keys or key < first_keys[category][0]:
+                first_keys[category] = [key, split, 1]
+            elif key == first_keys[category][0]:
+                first_keys[category][2] += 1
+
+    classes = sorted(category for category, count in class_counts.items() if count >= min_samples_per_class)
+    sizes = [0, 0, 0]
+    for category in classes:
+        for split in range(3):
+            sizes[split] += split_counts.get((category, split), 0)
+        # The rows with the first key of the class are moved to train
+        _, split, count = first_keys[category]
+        sizes[split] -= count
+        sizes[0] += count
+    first_keys = {category: first_keys[category][0] for category in classes}
+
+    X = [np.lib.format.open_memmap(os.path.join(output_directory, f'X_{name}_scaled.npy'), mode='w+',
+                                   dtype=np.float32, shape=(size, len(feature_columns)))
+         for name, size in zip(split_names, sizes)]
+    y = [np.lib.format.open_memmap(os.path.join(output_directory, f'y_{name}.npy'), mode='w+',
+                                   dtype=np.int32, shape=(size,))
+         for name, size in zip(split_names, sizes)]
+    written = [0, 0, 0]
+    scaler = StandardScaler()
+    for chunk in read_chunks(data_file):
+        chunk = chunk[chunk['Category'].isin(classes)]
+        if chunk.empty:
+            continue
+        splits = assign_splits(split_keys(chunk['URL']), chunk['Category'], first_keys)
+        labels = pd.Categorical(chunk['Category'], categories=classes).codes.astype(np.int32)
+        values = chunk[feature_columns].to_numpy(dtype=np.float64)
+        if (splits == 0).any():
+            scaler.partial_fit(values[splits == 0])
+        for split in range(3):
+            rows = splits == split
+            count = int(rows.sum())
+            X[split][written[split]:written[split] + count] = values[rows]
+            y[split][written[split]:written[split] + count] = labels[rows]
+            written[split] += count
+
+    for split in range(3):
+        for start in range(0, sizes[split], chunk_rows):
+            X[split][start:start + chunk_rows] = scaler.transform(X[split][start:start + chunk_rows])
+        X[split].flush()
+        y[split].flush()
+
+    save_schema(output_directory, classes, scaler)
+    print(f"Data processing completed and saved ({sizes[0]} train, {sizes[1]} val, {sizes[2]} test rows, "
+          f"{len(classes)} classes).")
+    return classes
+
+
+# Class list, feature order and scaler of the outputs, the model is trained and used with them
+def save_schema(output_directory, classes, scaler):
+    schema = {'features': feature_columns, 'classes': [str(category) for category in classes],
+              'scaler_mean': scaler.mean_.tolist(), 'scaler_scale': scaler.scale_.tolist()}
+    with open(os.path.join(output_directory, schema_file), 'w', encoding='utf-8') as f:
+        json.dump(schema, f, ensure_ascii=False)
+
+
+# Preprocessing in memory: stratified train_test_split and StandardScaler on the whole dataset
+def preprocess_in_memory(data_file, output_directory):
+    import pandas as pd
+    from sklearn.model_selection import train_test_split
+    from sklearn.preprocessing import StandardScaler
+
+    # Load the data
+    if is_table(data_file):
+        # Only the category and the feature columns are read, rows with a missing text field are filtered out
+        # on the table (the same rows dropna drops) without loading the text columns
+        data = pd.DataFrame(read_table(data_file, ['Category'] + feature_columns,
+                                       filters=[(column, 'not in', list(na_values)) for column in text_columns]))
+    else:
+        data = pd.read_csv(data_file)
+    data.dropna(inplace=True)
+
+    # Define the Features and Target columns
+    features = data[feature_columns]
+
+    # Target: Category column
+    target = data['Category']
+
+    # Remove classes with insufficient samples
+    class_counts = target.value_counts()
+    valid_classes = class_counts[class_counts >= min_samples_per_class].index
+
+    # Filter data and target to only keep valid classes
+    filtered_data = data[data['Category'].isin(valid_classes)]
+    features = features.loc[filtered_data.index]  # Select rows only in valid indices
+    target = filtered_data['Category']
+
+    # First data split
+    X_train, X_temp, y_train, y_temp = train_test_split(features, target, test_size=0.3, random_state=random_state,
+                                                        stratify=target)
+
+    # Remove classes with insufficient samples from the temporary set (X_temp, y_temp)
+    temp_class_counts = y_temp.value_counts()
+    valid_temp_classes = temp_class_counts[temp_class_counts >= min_samples_per_class].index
+
+    # Filter the temporary set to remove classes with insufficient samples
+    X_temp = X_temp[y_temp.isin(valid_temp_classes)]
+    y_temp = y_temp[y_temp.isin(valid_temp_classes)]
+
+    # Second data split
+    X_val, X_test, y_val, y_test = train_test_split(X_temp, y_temp, test_size=0.5, random_state=random_state,
+                                                    stratify=y_temp)
+
+    # Scaling the data (Standard Scaler)
+    scaler = StandardScaler()
+    X_train_scaled = scaler.fit_transform(X_train)
+    X_val_scaled = scaler.transform(X_val)
+    X_test_scaled = scaler.transform(X_test)
+
+    # Labels are saved as indexes of the sorted class list (no pickled string arrays)
+    classes = sorted(valid_classes)
+
+    def encode(y):
+        return pd.Categorical(y, categories=classes).codes.astype(np.int32)
+
+    # Save the files with full path
+    np.save(os.path.join(output_directory, 'X_train_scaled.npy'), X_train_scaled)
+    np.save(os.path.join(output_directory, 'y_train.npy'), encode(y_train))
+    np.save(os.path.join(output_directory, 'X_val_scaled.npy'), X_val_scaled)
+    np.save(os.path.join(output_directory, 'y_val.npy'), encode(y_val))
+    np.save(os.path.join(output_directory, 'X_test_scaled.npy'), X_test_scaled)
+    np.save(os.path.join(output_directory, 'y_test.npy'), encode(y_test))
+    save_schema(output_directory, classes, scaler)
+
+    print("Data processing completed and saved.")
+    return classes
+
+
+# Writing the train/val/test arrays and the schema into output_directory, returns the class list
+def preprocess(data_file=data_file, output_directory=None, chunked=chunked):
+    output_directory = output_directory or os.getcwd()
+    if chunked:
+        return preprocess_chunked(data_file, output_directory)
+    return preprocess_in_memory(data_file, output_directory)
+
+
+if __name__ == "__main__":
+    preprocess(*sys.argv[1:2])
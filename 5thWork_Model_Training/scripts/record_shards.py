@@ -0,0 +1,119 @@
+import glob
+import math
+import os
+import sys
+import numpy as np
+
+# Training records as shards of shard_rows rows: <split>-00000.X.npy (float32 features) and
+# <split>-00000.y.npy (int32 labels), read through memory maps
+shard_directory = 'shards'
+shard_rows = 100000
+
+# Rows read from a shard at a time, rows kept in the shuffle buffer and shards read in parallel
+block_rows = 1024
+shuffle_buffer = 50000
+interleave_cycle = 4
+batch_size = 32
+
+
+# Rows of the shards are a random permutation of the split: the chunked preprocessing writes the rows grouped
+# by category, a shard (and the shuffle buffer reading it) would otherwise hold only a few classes
+random_state = 42
+
+
+# Files the shards of a split are made from (preprocessing.json changes with the class list)
+def source_paths(split, source_directory):
+    return [os.path.join(source_directory, name) for name in
+            (f'X_{split}_scaled.npy', f'y_{split}.npy', 'preprocessing.json')]
+
+
+# Cutting the preprocessed arrays of a split into shards, one shard in memory at a time
+def write_shards(split, source_directory=None, output_directory=shard_directory, shard_rows=shard_rows,
+                 random_state=random_state):
+    source_directory = source_directory or os.getcwd()
+    X = np.load(os.path.join(source_directory, f'X_{split}_scaled.npy'), mmap_mode='r')
+    y = np.load(os.path.join(source_directory, f'y_{split}.npy'), mmap_mode='r')
+    os.makedirs(output_directory, exist_ok=True)
+    for path in glob.glob(os.path.join(output_directory, f'{split}-*.npy')):
+        os.remove(path)
+    order = np.random.default_rng(random_state).permutation(len(y))
+    count = 0
+    for number, start in enumerate(range(0, len(y), shard_rows)):
+        base = os.path.join(output_directory, f'{split}-{number:05d}')
+        # Rows are read in file order and put in the permuted order in memory
+        rows = order[start:start + shard_rows]
+        sorted_rows = np.sort(rows)
+        position = np.searchsorted(sorted_rows, rows)
+        np.save(base + '.X.npy', np.asarray(X[sorted_rows], dtype=np.float32)[position])
+        np.save(base + '.y.npy', np.asarray(y[sorted_rows], dtype=np.int32)[position])
+        count += 1
+    return count
+
+
+# Whether the shards of a split are missing or older than the preprocessed arrays they were cut from
+def shards_stale(split, source_directory=None, directory=shard_directory):
+    source_directory = source_directory or os.getcwd()
+    paths = shard_paths(split, directory)
+    if not paths:
+        return True
+    written = min(os.path.getmtime(path + ending) for path in paths for ending in ('.X.npy', '.y.npy'))
+    return any(os.path.exists(path) and os.path.getmtime(path) > written
+               for path in source_paths(split, source_directory))
+
+
+# Shards of a split, as paths without the .X.npy/.y.npy ending
+def shard_paths(split, directory=shard_directory):
+    return sorted(path[:-len('.X.npy')] for path in glob.glob(os.path.join(directory, f'{split}-*.X.npy')))
+
+
+# (rows, features) of all shards together, read from the .npy headers only
+def shard_shape(paths):
+    rows = features = 0
+    for path in paths:
+        X = np.load(path + '.X.npy', mmap_mode='r')
+        rows += X.shape[0]
+        features = X.shape[1]
+    return rows, features
+
+
+# Blocks of (features, labels) of one shard
+def read_shard(path):
+    path = path.decode('utf-8') if isinstance(path, bytes) else path
+    X = np.load(path + '.X.npy', mmap_mode='r')
+    y = np.load(path + '.y.npy', mmap_mode='r')
+    for start in range(0, len(y), block_rows):
+        yield np.array(X[start:start + block_rows]), np.array(y[start:start + block_rows])
+
+
+# tf.data pipeline of a split: shards are read interleaved and in parallel, rows are shuffled in a
+# bounded buffer (training only), batched and prefetched, so memory does not grow with the dataset
+def make_dataset(split, directory=shard_directory, batch_size=batch_size, training=True):
+    import tensorflow as tf
+
+    paths = shard_paths(split, directory)
+    if not paths:
+        raise FileNotFoundError(f"No {split} shards in {directory}, run record_shards.py first")
+    rows, features = shard_shape(paths)
+    signature = (tf.TensorSpec(shape=(None, features), dtype=tf.float32),
+                 tf.TensorSpec(shape=(None,), dtype=tf.int32))
+
+    files = tf.data.Dataset.from_tensor_slices(paths)
+    if training:
+        files = files.shuffle(len(paths), reshuffle_each_iteration=True)
+    dataset = files.interleave(
+        lambda path: tf.data.Dataset.from_generator(read_shard, args=(path,), output_signature=signature),
+        cycle_length=min(interleave_cycle, len(paths)), num_parallel_calls=tf.data.AUTOTUNE,
+        deterministic=not training)
+    dataset = dataset.unbatch()
+    if training:
+        dataset = dataset.shuffle(shuffle_buffer, reshuffle_each_iteration=True)
+    dataset = dataset.batch(batch_size)
+    dataset = dataset.apply(tf.data.experimental.assert_cardinality(math.ceil(rows / batch_size)))
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+if __name__ == "__main__":
+    # python record_shards.py [shard rows]   shards of the train, val and test outputs of preproccessing.py
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else shard_rows
+    for split in ('train', 'val', 'test'):
+        print(f"{split}: {write_shards(split, shard_rows=rows)} shards saved to {shard_directory}.")
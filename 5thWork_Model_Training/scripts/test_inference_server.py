@@ -0,0 +1,93 @@
+import http.client
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from inference_server import InferenceHandler, InferenceServer, MicroBatcher
+from model import CategoryModel
+
+# Feature value of a row which makes the stand-in model fail
+failing_value = 99
+
+# Probability of the most likely class (as float32, the way the batcher reads it)
+top_probability = float(np.float32(0.7))
+
+
+# Model with one feature whose value is the index of the most likely class, so every answer shows which row
+# it was computed from. Rows are parsed by CategoryModel.features_of
+class StandInModel(CategoryModel):
+    def __init__(self):
+        self.features = ['value']
+        self.classes = ['a', 'b', 'c', 'd']
+        self.mean = np.zeros(1, dtype=np.float32)
+        self.scale = np.ones(1, dtype=np.float32)
+
+    def scaled_predict_proba(self, X):
+        indexes = X[:, 0].astype(int)
+        if (indexes == failing_value).any():
+            raise RuntimeError("Model failure")
+        probabilities = np.full((len(X), len(self.classes)), 0.1, dtype=np.float32)
+        probabilities[np.arange(len(X)), indexes] = top_probability
+        return probabilities
+
+
+def start_server():
+    server = InferenceServer(('127.0.0.1', 0), InferenceHandler)
+    server.batcher = MicroBatcher(StandInModel(), max_batch=16, max_wait=0.01)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def post(server, body):
+    connection = http.client.HTTPConnection(*server.server_address[:2], timeout=30)
+    connection.request('POST', '/predict', body, {'Content-Type': 'application/json'})
+    response = connection.getresponse()
+    data = json.loads(response.read())
+    connection.close()
+    return response.status, data
+
+
+# Concurrent callers end up in shared batches, each one gets the result of its own row and top_k
+def test_results_are_routed_to_their_callers():
+    batcher = MicroBatcher(StandInModel(), max_batch=16, max_wait=0.01)
+    try:
+        with ThreadPoolExecutor(max_workers=32) as executor:
+            futures = [executor.submit(batcher.predict, [i % 4], 1 + i % 3, 30) for i in range(200)]
+            results = [future.result() for future in futures]
+    finally:
+        batcher.close()
+    for i, result in enumerate(results):
+        assert len(result) == 1 + i % 3
+        assert result[0] == ('abcd'[i % 4], top_probability)
+    # The counters are updated after the results are set, they are read once the worker has ended
+    assert batcher.batches < batcher.requests == 200
+
+
+def test_predict_answers():
+    server = start_server()
+    try:
+        status, data = post(server, json.dumps({'features': {'value': 2}, 'top_k': 1}))
+        assert status == 200 and data == {'categories': [['c', top_probability]]}
+        status, data = post(server, json.dumps({'rows': [[0], [3]], 'top_k': 1}))
+        assert status == 200 and [categories[0][0] for categories in data['categories']] == ['a', 'd']
+        # Malformed requests: invalid JSON, not an object, no features, a missing or non-numeric feature
+        for body in ['{', '[1]', '{}', '{"features": {}}', '{"features": ["x"]}']:
+            status, data = post(server, body)
+            assert status == 400 and 'error' in data
+        # A model error is answered, not left hanging
+        status, data = post(server, json.dumps({'features': [failing_value]}))
+        assert status == 500 and 'Model failure' in data['error']
+    finally:
+        server.shutdown()
+        server.batcher.close()
+
+
+# Rows queued before close() are still scored, then the worker thread ends
+def test_close_finishes_queued_rows():
+    batcher = MicroBatcher(StandInModel(), max_batch=4, max_wait=0.05)
+    futures = [batcher.submit([i % 4], 1) for i in range(10)]
+    batcher.close()
+    assert not batcher._worker.is_alive()
+    assert [future.result(0)[0][0] for future in futures] == ['abcd'[i % 4] for i in range(10)]
@@ -0,0 +1,47 @@
+import json
+
+import numpy as np
+import pytest
+
+from model import create_model, schema_path_for
+from numpy_model import NumpyCategoryModel, export
+
+feature_count = 12
+classes = ['a', 'b', 'c', 'd', 'e']
+
+
+# Saving a Keras model with its schema (identity scaler) the way train() does
+def save_model(model, tmp_path):
+    model_path = str(tmp_path / 'model.keras')
+    model.save(model_path)
+    with open(schema_path_for(model_path), 'w', encoding='utf-8') as f:
+        json.dump({'features': [f'f{i}' for i in range(feature_count)], 'classes': classes,
+                   'scaler_mean': [0.0] * feature_count, 'scaler_scale': [1.0] * feature_count}, f)
+    return model_path
+
+
+# The NumPy forward pass of the exported weights gives the probabilities of model.predict (int8 weights
+# within the quantization error)
+@pytest.mark.parametrize('dtype, tolerance', [('float32', 1e-5), ('int8', 3e-2)])
+def test_export_matches_keras(tmp_path, dtype, tolerance):
+    model = create_model(feature_count, len(classes))
+    model_path = save_model(model, tmp_path)
+    X = np.random.default_rng(0).normal(size=(256, feature_count)).astype(np.float32)
+    expected = model.predict(X, verbose=0)
+
+    path = export(model_path, str(tmp_path / f'model_{dtype}.npz'), dtype)
+    numpy_model = NumpyCategoryModel(path)
+    assert numpy_model.classes == classes
+    assert np.abs(numpy_model.scaled_predict_proba(X) - expected).max() < tolerance
+
+
+# A layer with weights which is not Dense would be dropped by the forward pass, the export fails instead
+def test_export_rejects_other_layers(tmp_path):
+    from tensorflow.keras.layers import BatchNormalization, Dense, Input
+    from tensorflow.keras.models import Sequential
+
+    model = Sequential([Input(shape=(feature_count,)), Dense(8, activation='relu'), BatchNormalization(),
+                        Dense(len(classes), activation='softmax')])
+    model_path = save_model(model, tmp_path)
+    with pytest.raises(ValueError):
+        export(model_path, str(tmp_path / 'model.npz'))
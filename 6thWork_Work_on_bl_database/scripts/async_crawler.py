@@ -0,0 +1,184 @@
+import asyncio
+import contextvars
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+from requests.structures import CaseInsensitiveDict
+
+# Modules shared by all work folders
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'shared'))
+
+from crawl_journal import is_final
+from http_session import DEFAULT_HEADERS
+from page_snapshot import PageSnapshot, check_content_type, chunk_bytes, html_content_types, max_body_bytes
+from politeness import HostScheduler, PolitenessPolicy, host_of, retry_after_seconds
+from streaming import Reorderer
+
+logger = logging.getLogger(__name__)
+
+# on_connect of the request running in the current task, read by PeerConnector
+_on_connect = contextvars.ContextVar('on_connect', default=None)
+
+
+# Connector which hands the IP address of the server to the request's on_connect while the connection is held:
+# aiohttp releases the connection as soon as a small body is read, before the response is returned
+class PeerConnector(aiohttp.TCPConnector):
+    async def connect(self, req, traces, timeout):
+        connection = await super().connect(req, traces, timeout)
+        on_connect = _on_connect.get()
+        if on_connect is not None and connection.transport is not None:
+            peer = connection.transport.get_extra_info('peername')
+            if peer:
+                on_connect(peer[0])
+        return connection
+
+
+# Downloading one page without blocking the event loop, on_connect gets the IP address of the server
+# (the session needs a PeerConnector).
+# Like fetch_snapshot: other content types of 2xx answers are rejected from the headers and the body is cut at
+# max_bytes. Throttling answers are returned whatever their body, so their status and Retry-After reach the policy
+async def fetch_snapshot_async(session, url, on_connect=None, max_bytes=max_body_bytes,
+                               content_types=html_content_types):
+    token = _on_connect.set(on_connect)
+    try:
+        response = await session.get(url)
+    finally:
+        _on_connect.reset(token)
+    async with response:
+        headers = CaseInsensitiveDict(response.headers)
+        check_content_type(url, headers, content_types, response.status)
+        chunks = []
+        size = 0
+        async for chunk in response.content.iter_chunked(chunk_bytes):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= max_bytes:
+                # The rest of the body is dropped with the connection
+                response.close()
+                break
+        content = b''.join(chunks)[:max_bytes]
+        return PageSnapshot(str(response.url), response.status, headers, content, response.charset)
+
+
+# Timeouts and connection resets (not DNS, refused or TLS errors) are overload signals
+def is_overload_error(error):
+    if isinstance(error, asyncio.TimeoutError):
+        return True
+    return isinstance(error, aiohttp.ClientOSError) and not isinstance(error, aiohttp.ClientConnectorError) \
+        or isinstance(error, aiohttp.ServerDisconnectedError)
+
+
+# Fetching rows with a global concurrency cap and per-host politeness (AIMD limits, Retry-After, retries of
+# throttled rows, hosts interleaved by the scheduler), extraction runs in a small thread pool.
+# At most `window` rows are between the reader and on_result (in flight or waiting for their turn when ordered)
+async def crawl(rows, extract, on_result, url_for=lambda row: row['URL'], concurrency=1000, per_host=4,
+                timeout=12, extract_workers=16, cache=None, window=None, ordered=False, politeness=None,
+                max_bytes=max_body_bytes, logger=logger):
+    window_slots = asyncio.Semaphore(window or concurrency * 2)
+    policy = politeness or PolitenessPolicy(per_host=per_host)
+    scheduler = HostScheduler(policy)
+    reorderer = Reorderer()
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=extract_workers)
+
+    connector = PeerConnector(limit=concurrency, ttl_dns_cache=300)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+
+    # Page cache first (sqlite and disk reads run in the thread pool), network only on a miss.
+    # Returns (snapshot, retry), retry is True when the host throttled the request and it is sent again later
+    async def fetch_or_load(session, host, url, attempt):
+        if cache is not None:
+            try:
+                snapshot = await loop.run_in_executor(executor, cache.lookup, url)
+            except Exception:
+                policy.cancel(host)
+                raise
+            if snapshot is not None:
+                policy.cancel(host)
+                return snapshot, False
+        connected = []
+
+        # Only the first connection counts (a redirect connects again)
+        def on_connect(ip):
+            if not connected:
+                connected.append(ip)
+                policy.connected(host, ip)
+
+        started = loop.time()
+        try:
+            snapshot = await fetch_snapshot_async(session, url, on_connect, max_bytes)
+        except Exception as e:
+            overloaded = is_overload_error(e)
+            policy.finish(host, connected[0] if connected else None, failed=overloaded)
+            if overloaded and policy.should_retry(attempt):
+                return None, True
+            raise
+        retry_after = retry_after_seconds(snapshot.headers)
+        throttled = policy.finish(host, connected[0] if connected else None, status=snapshot.status_code,
+                                  latency=loop.time() - started, retry_after=retry_after)
+        if throttled and policy.should_retry(attempt, retry_after):
+            return None, True
+        if cache is not None:
+            await loop.run_in_executor(executor, cache.put, url, snapshot)
+        return snapshot, False
+
+    async def worker(session):
+        while True:
+            item = await scheduler.get()
+            if item is None:
+                return
+            host, (index, row, attempt) = item
+            url = url_for(row)
+            error = None
+            try:
+                snapshot, retry = await fetch_or_load(session, host, url, attempt)
+            except Exception as e:
+                logger.error(f"Exception while fetching {url}: {e!r}")
+                snapshot, retry, error = None, False, e
+            if retry:
+                # Back to the front of the host's queue, the scheduler waits for the host's pause
+                scheduler.put(host, (index, row, attempt + 1), retry=True)
+                scheduler.done(host)
+                continue
+            scheduler.done(host)
+
+            result = None
+            final = is_final(snapshot, error)
+            if snapshot is not None:
+                try:
+                    result = await loop.run_in_executor(executor, extract, row, snapshot)
+                except Exception as e:
+                    logger.error(f"Exception while extracting {url}: {e!r}")
+                    final = False
+            # Called for every row, result is None for skipped rows. final is False when the row failed for
+            # a reason which may go away (timeout, retryable answer, extraction error)
+            if ordered:
+                for ready in reorderer.add(index, (row, result, final)):
+                    on_result(*ready)
+                    window_slots.release()
+            else:
+                on_result(row, result, final)
+                window_slots.release()
+
+    try:
+        async with aiohttp.ClientSession(connector=connector, timeout=client_timeout,
+                                         headers=DEFAULT_HEADERS) as session:
+            workers = [asyncio.create_task(worker(session)) for _ in range(concurrency)]
+            # The reader is only pulled as fast as finished rows free window slots
+            for index, row in enumerate(rows):
+                await window_slots.acquire()
+                scheduler.put(host_of(url_for(row)), (index, row, 0))
+            scheduler.close()
+            await asyncio.gather(*workers)
+    finally:
+        executor.shutdown(wait=True)
+    if policy.throttled:
+        logger.info(f"{policy.throttled} throttled answers, {policy.retried} requests sent again")
+
+
+# Synchronous entry point for the crawl scripts
+def run_crawl(rows, extract, on_result, **kwargs):
+    asyncio.run(crawl(rows, extract, on_result, **kwargs))
@@ -1,13 +1,23 @@
-import requests
-import csv
-from bs4 import BeautifulSoup
 import concurrent.futures
 from datetime import datetime
 import os
+import sys
 import time
 import logging
 from logging.handlers import TimedRotatingFileHandler
 
+# Modules shared by all work folders
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'shared'))
+
+from page_snapshot import fetch_snapshot
+from async_crawler import run_crawl
+from politeness import HostThrottle, PolitenessPolicy
+from page_cache import PageCache
+from streaming import bounded_map
+from crawl_journal import CrawlJournal, JournaledWriter, is_final, journal_key, open_resumable_csv
+from url_index import UrlIndex
+from columnar import open_rows
+
 end_time = datetime.now()
 
 logger = logging.getLogger(f"base_website_data")
@@ -27,21 +37,65 @@ formatter.converter = time.gmtime
 handler.setFormatter(formatter)
 logger.addHandler(handler)
 
+# The input may also be a columnar table (a path ending with .table, see columnar.py)
 input_csv_file = '../data/url_and_categories_shp.csv'
 output_csv_file = '../data/url_meta_info_shp.csv'
 
+# Journal of finished URLs, resume=False starts the output from scratch
+journal_file = output_csv_file + '.journal'
+resume = True
+
+# Crawl engine ('async' or 'threads') and its limits
+crawl_engine = 'async'
+max_concurrency = 2000
+per_host_concurrency = 4
+
+# Politeness per host: the concurrency of a host adapts between 1 and max_per_host (AIMD, starting at
+# per_host_concurrency), Retry-After is respected and throttled rows are sent again up to max_retries times
+max_per_host = 16
+max_retries = 2
+politeness = None
+host_throttle = None
+
+# Index of canonical URLs: a page which already has a metadata record (found under another category or in an
+# earlier run) is answered from the index instead of being downloaded again. Not used with preserve_order,
+# answers from the index would be written ahead of the rows in flight
+use_url_index = True
+url_index = None
+
+# Page bodies are streamed and cut at this size, answers which are not HTML are skipped from their headers
+max_page_bytes = 2 * 1024 ** 2
+
+# Rows read ahead of the writer (memory stays flat for any input size), results are written
+# as they finish unless preserve_order is set
+max_in_flight = 4000
+preserve_order = False
+
+# Downloaded pages are kept in ../data/page_cache and shared by both crawl stages,
+# offline_mode only reads from this cache (no network)
+use_page_cache = True
+offline_mode = False
+page_cache = None
+
 headers = ['URL', 'Category', 'Language', 'Title', 'Meta_Description']
 
 
 def get_website_metadata(url):
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
-        }
-        response = requests.get(url, headers=headers, timeout=12, verify=True)
-        response.raise_for_status()
+        snapshot = fetch_snapshot(url, timeout=12, verify=True, cache=page_cache, throttle=host_throttle,
+                                  max_bytes=max_page_bytes)
+        return parse_website_metadata(snapshot)
+
+    except Exception as e:
+        logger.info(f"Error while parsing {url}: {e}")
+        return 'N/A', 'N/A', 'N/A'
+
+
+def parse_website_metadata(snapshot):
+    try:
+        snapshot.raise_for_status()
 
-        soup = BeautifulSoup(response.text, 'html.parser')
+        soup = snapshot.soup
 
         meta_description = soup.find('meta', attrs={'name': 'description'}) or soup.find('meta', attrs={
             'property': 'og:description'})
@@ -54,7 +108,7 @@ def get_website_metadata(url):
         return lang, title, description_content
 
     except Exception as e:
-        logger.info(f"Error while parsing {url}: {e}")
+        logger.info(f"Error while parsing {snapshot.url}: {e}")
         return 'N/A', 'N/A', 'N/A'
 
 
@@ -64,13 +118,29 @@ def add_scheme(url):
     return url
 
 
+# Returns (result, final), final is False when the download or the answer may be different on a retry
 def process_url(row):
+    full_url = add_scheme(row['URL'])
+    try:
+        snapshot = fetch_snapshot(full_url, timeout=12, verify=True, cache=page_cache, throttle=host_throttle,
+                                  max_bytes=max_page_bytes)
+    except Exception as e:
+        logger.info(f"Error while fetching {full_url}: {e}")
+        return None, is_final(None, e)
+    return extract_metadata(row, snapshot), is_final(snapshot)
+
+
+def extract_metadata(row, snapshot):
+    return build_row(row, parse_website_metadata(snapshot))
+
+
+def build_row(row, metadata):
     url = row['URL']
     category = row['Category']
 
     full_url = add_scheme(url)
 
-    language, title, meta_description = get_website_metadata(full_url)
+    language, title, meta_description = metadata
 
     if 'N/A' in [language, title, meta_description]:
         logger.info(f"Skipping {url} due to missing metadata (Language: {language}, Title: {title}, Meta: {meta_description})")
@@ -79,17 +149,61 @@ def process_url(row):
     return [full_url, category, language, title, meta_description]
 
 
-with open(input_csv_file, mode='r', newline='', encoding='utf-8') as infile, \
-        open(output_csv_file, mode='w', newline='', encoding='utf-8') as outfile:
-    reader = csv.DictReader(infile)
-    writer = csv.writer(outfile)
-    writer.writerow(headers)
-
-    with concurrent.futures.ThreadPoolExecutor(max_workers=50) as executor:
-        results = executor.map(process_url, reader)
-
-        for result in results:
-            if result is not None:
-                writer.writerow(result)
-
-print(f"Metadata has been saved to {output_csv_file}. {end_time}")
\ No newline at end of file
+if __name__ == "__main__":
+    if use_page_cache:
+        page_cache = PageCache(offline=offline_mode)
+
+    politeness = PolitenessPolicy(per_host=per_host_concurrency, max_per_host=max_per_host,
+                                  max_retries=max_retries)
+    host_throttle = HostThrottle(politeness)
+
+    if use_url_index and not preserve_order:
+        url_index = UrlIndex()
+
+    # Finished URLs are journaled, a restarted run skips them and appends to the existing output
+    journal = CrawlJournal(journal_file)
+
+    with open_rows(input_csv_file, encoding='utf-8') as (_, reader), \
+            open_resumable_csv(output_csv_file, headers, journal, ('URL', 'Category'), resume=resume) as outfile:
+        output = JournaledWriter(outfile, journal)
+        # A URL listed under several categories has one row per category, the journal keeps them apart
+        rows = journal.pending(reader, key_for=lambda row: journal_key(add_scheme(row['URL']), row['Category']))
+
+        # Rows which failed for a reason which may go away (final False) are not journaled, a restart retries them
+        def handle_result(row, result, final=True, from_index=False):
+            output.write(journal_key(add_scheme(row['URL']), row['Category']), result, final)
+            if url_index is not None and result is not None and not from_index:
+                url_index.put_record(add_scheme(row['URL']), 'metadata', result[2:])
+
+        # Rows whose page has a metadata record are written right away, the others go to the crawl
+        def rows_to_fetch(rows):
+            for row in rows:
+                url_index.add(add_scheme(row['URL']), row['Category'], source='crawl')
+                found, record = url_index.get_record(add_scheme(row['URL']), 'metadata')
+                if found:
+                    handle_result(row, build_row(row, record), from_index=True)
+                else:
+                    yield row
+
+        if url_index is not None:
+            rows = rows_to_fetch(rows)
+
+        if crawl_engine == 'async':
+            run_crawl(rows, extract_metadata, handle_result, url_for=lambda row: add_scheme(row['URL']),
+                      concurrency=max_concurrency, per_host=per_host_concurrency, timeout=12, cache=page_cache,
+                      window=max_in_flight, ordered=preserve_order, politeness=politeness,
+                      max_bytes=max_page_bytes, logger=logger)
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=50) as executor:
+                results = bounded_map(executor, lambda row: (row, process_url(row)), rows,
+                                      window=max_in_flight, ordered=preserve_order)
+
+                for row, (result, final) in results:
+                    handle_result(row, result, final)
+
+        output.flush()
+    journal.close()
+    if url_index is not None:
+        url_index.close()
+
+    print(f"Metadata has been saved to {output_csv_file}. {end_time}")
@@ -0,0 +1,54 @@
+import os
+import tarfile
+
+# The blacklist release as shipped (plain tar, or compressed: .tar.gz / .tar.bz2 / .tar.xz)
+archive_path = '../data/bl/bl'
+
+
+# Category of a list file inside the release ("blacklists/shopping/domains" -> "shopping"), None for other files
+def list_category(member_name, list_name='domains'):
+    parts = [part for part in member_name.split('/') if part not in ('', '.')]
+    if len(parts) < 2 or parts[-1] != list_name:
+        return None
+    return parts[-2]
+
+
+# Lines of a list file, one at a time (the file is never loaded whole)
+def _list_lines(binary_file):
+    for line in binary_file:
+        line = line.decode('utf-8', errors='replace').strip()  # Cleaning blanks
+        if line:
+            yield line
+
+
+# (domain, category) pairs streamed out of the archive without extracting it. The archive is read
+# front to back in stream mode ('r|*' detects the compression), so memory stays constant for any size
+def iter_archive(path=archive_path, categories=None, list_name='domains'):
+    with tarfile.open(path, mode='r|*') as archive:
+        for member in archive:
+            if not member.isfile():
+                continue
+            category = list_category(member.name, list_name)
+            if category is None or (categories is not None and category not in categories):
+                continue
+            for domain in _list_lines(archive.extractfile(member)):
+                yield domain, category
+
+
+# Same for a release which is already extracted into <directory>/<category>/domains
+def iter_directory(directory, categories=None, list_name='domains'):
+    for category in sorted(os.listdir(directory)):
+        file_path = os.path.join(directory, category, list_name)
+        if categories is not None and category not in categories:
+            continue
+        if os.path.isfile(file_path):
+            with open(file_path, 'rb') as f:
+                for domain in _list_lines(f):
+                    yield domain, category
+
+
+# Archive file or extracted directory
+def iter_blacklist(source=archive_path, categories=None, list_name='domains'):
+    if os.path.isdir(source):
+        return iter_directory(source, categories, list_name)
+    return iter_archive(source, categories, list_name)
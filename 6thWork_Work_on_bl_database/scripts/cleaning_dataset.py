@@ -1,20 +1,24 @@
-import csv
+import os
+import sys
 
+# Modules shared by all work folders
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'shared'))
+
+from columnar import open_rows, open_writer
+
+# Both may be CSV files or columnar tables (paths ending with .table, see columnar.py)
 input_csv_file = '../data/url_meta_info.csv'
 output_csv_file = '../data/url_and_categories_shp.csv'
 
-# Okuma ve yazma işlemi
-with open(input_csv_file, mode='r', newline='', encoding='utf-8') as infile, \
-     open(output_csv_file, mode='w', newline='', encoding='utf-8') as outfile:
+# Rows without language, title or meta description are dropped (on a table the filter is
+# evaluated column-wise, chunks without any matching row are never read)
+filters = [('Language', '!=', 'N/A'), ('Title', '!=', 'N/A'), ('Meta_Description', '!=', 'N/A')]
 
-    reader = csv.DictReader(infile)
-    fieldnames = reader.fieldnames
-
-    writer = csv.DictWriter(outfile, fieldnames=fieldnames)
-    writer.writeheader()
+# Okuma ve yazma işlemi
+with open_rows(input_csv_file, filters=filters) as (fieldnames, reader), \
+        open_writer(output_csv_file, fieldnames) as writer:
 
     for row in reader:
-        if row['Language'] != 'N/A' and row['Title'] != 'N/A' and row['Meta_Description'] != 'N/A':
-            writer.writerow(row)
+        writer.writerow(row)
 
 print(f"Cleaned CSV file has been saved as {output_csv_file}.")
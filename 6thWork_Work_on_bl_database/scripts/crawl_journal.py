@@ -0,0 +1,154 @@
+import csv
+import os
+import socket
+import sqlite3
+import ssl
+import sys
+import time
+
+# Modules shared by all work folders
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'shared'))
+
+from page_snapshot import UnwantedContentError
+
+# Answers which may be different when the URL is fetched again (timeouts, throttling, server errors)
+retryable_statuses = (408, 425, 429)
+
+
+# Errors which would come again on a retry: unwanted content types, unknown domains (NXDOMAIN), refused
+# connections and invalid certificates. The whole chain of causes is searched (requests and aiohttp wrap them).
+# Timeouts, resets, temporary DNS failures and misses of the offline page cache are not permanent
+def is_permanent_error(error):
+    seen = set()
+    pending = [error]
+    while pending:
+        e = pending.pop()
+        if not isinstance(e, BaseException) or id(e) in seen:
+            continue
+        seen.add(id(e))
+        if isinstance(e, (UnwantedContentError, ConnectionRefusedError, ssl.SSLCertVerificationError)):
+            return True
+        if isinstance(e, socket.gaierror) and e.errno in (socket.EAI_NONAME, getattr(socket, 'EAI_NODATA', None)):
+            return True
+        pending.extend([e.__cause__, e.__context__, getattr(e, 'reason', None), getattr(e, 'os_error', None)])
+        pending.extend(e.args)
+    return False
+
+
+# Whether a row's outcome is definitive: its page was downloaded and the answer was a success or a
+# permanent client error, or the download failed with a permanent error. Timeouts, 408/425/429 and 5xx
+# answers are not, a restarted run tries them again
+def is_final(snapshot, error=None):
+    if snapshot is None:
+        return error is not None and is_permanent_error(error)
+    return snapshot.status_code < 500 and snapshot.status_code not in retryable_statuses
+
+
+# Journal key of a row: its URL, or its URL and category when a URL is listed under several categories
+def journal_key(*values):
+    return '\t'.join(values)
+
+
+# Durable list of finished URLs, so an interrupted crawl continues where it stopped
+class CrawlJournal:
+    def __init__(self, path):
+        self.path = path
+        self._db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=FULL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS done (url TEXT PRIMARY KEY, written INTEGER, finished_at REAL)')
+        self._db.commit()
+
+    def is_done(self, url):
+        return self._db.execute('SELECT 1 FROM done WHERE url = ?', (url,)).fetchone() is not None
+
+    # Rows of the input which are not finished yet
+    def pending(self, rows, key_for=lambda row: row['URL']):
+        for row in rows:
+            if not self.is_done(key_for(row)):
+                yield row
+
+    def mark_done(self, url, written):
+        self._db.execute('INSERT OR REPLACE INTO done VALUES (?, ?, ?)', (url, int(written), time.time()))
+
+    def commit(self):
+        self._db.commit()
+
+    def reset(self):
+        self._db.execute('DELETE FROM done')
+        self._db.commit()
+
+    def count(self):
+        return self._db.execute('SELECT COUNT(*) FROM done').fetchone()[0]
+
+    def close(self):
+        self._db.commit()
+        self._db.close()
+
+
+# Lines of a binary file, state keeps the end offset of the last line and whether it was complete
+def _lines_with_offsets(f, state):
+    for line in f:
+        state[0] += len(line)
+        state[1] = line.endswith(b'\n')
+        yield line.decode('utf-8', errors='replace')
+
+
+# Opening the output CSV for appending: a half-written last row of an interrupted run is cut off
+# and rows which are already in the file are recorded in the journal
+def open_resumable_csv(path, headers, journal, key_columns=('URL',), resume=True):
+    if not resume or not os.path.exists(path) or os.path.getsize(path) == 0:
+        journal.reset()
+        outfile = open(path, mode='w', newline='', encoding='utf-8')
+        csv.writer(outfile).writerow(headers)
+        outfile.flush()
+        return outfile
+
+    key_indexes = [headers.index(column) for column in key_columns]
+    good_offset = 0
+    state = [0, True]
+    with open(path, 'rb') as f:
+        reader = csv.reader(_lines_with_offsets(f, state))
+        try:
+            for i, record in enumerate(reader):
+                if not state[1] or len(record) != len(headers):
+                    break
+                good_offset = state[0]
+                if i > 0:
+                    journal.mark_done(journal_key(*[record[i] for i in key_indexes]), True)
+        except csv.Error:
+            pass
+    journal.commit()
+
+    if good_offset < os.path.getsize(path):
+        with open(path, 'r+b') as f:
+            f.truncate(good_offset)
+    return open(path, mode='a', newline='', encoding='utf-8')
+
+
+# CSV writer which records the finished rows in the journal, the CSV is flushed to disk
+# before the journal is committed, so the journal never gets ahead of the file.
+# A skipped row (result None) is only journaled when its outcome is final
+class JournaledWriter:
+    def __init__(self, outfile, journal, commit_every=200):
+        self.outfile = outfile
+        self.writer = csv.writer(outfile)
+        self.journal = journal
+        self.commit_every = commit_every
+        self._pending = 0
+
+    def write(self, url, result, final=True):
+        if result is not None:
+            self.writer.writerow(result)
+        elif not final:
+            return
+        self.journal.mark_done(url, result is not None)
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self.flush()
+
+    def flush(self):
+        self.outfile.flush()
+        os.fsync(self.outfile.fileno())
+        self.journal.commit()
+        self._pending = 0
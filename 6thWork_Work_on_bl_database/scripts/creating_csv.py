@@ -1,30 +1,46 @@
-import os
 import csv
+import os
+import sys
+
+# Modules shared by all work folders
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'shared'))
+
+from url_index import UrlIndex
+from blacklist_archive import iter_blacklist
+
+# Blacklist release: the archive itself (plain or compressed tar) or a directory it was extracted to
+blacklist_source = "../data/bl/bl"
 
-base_directory = "../data/bl"
+# Categories to take from the release, None takes all of them (e.g. ['shopping', 'games'])
+categories = None
 
 output_csv = "../data/urls_and_categories_news2.csv"
 
 headers = ["URL", "Category"]
 
+# One row per (canonical URL, category) like the release itself: a URL listed under several categories keeps
+# all of its labels (the index holds the same many-to-many mapping). Only repeats of a URL within one category
+# are skipped; a category comes from one list file, so only its URLs are kept in memory
+url_index = UrlIndex()
+duplicates = 0
+
 with open(output_csv, mode='w', newline='', encoding='utf-8') as csv_file:
     writer = csv.writer(csv_file)
     writer.writerow(headers)  # Writing headers
 
-    for category_folder in os.listdir(base_directory):
-        category_path = os.path.join(base_directory, category_folder)
-
-        if os.path.isdir(category_path):
-            for file_name in os.listdir(category_path):
-                file_path = os.path.join(category_path, file_name)
-
-                if os.path.isfile(file_path) and file_name == 'domains':
-                    with open(file_path, 'r', encoding='utf-8') as file:
-                        urls = file.readlines()  # Read all rows
-
-                        for url in urls:
-                            cleaned_url = url.strip()  # Cleaning blanks
-                            if cleaned_url:
-                                writer.writerow([cleaned_url, category_folder])
-
-print(f"Data was written at {output_csv} file.")
+    # Domains are streamed line by line out of the release, nothing is extracted or read whole
+    current_category = None
+    seen = set()
+    for cleaned_url, category in iter_blacklist(blacklist_source, categories):
+        if category != current_category:
+            current_category = category
+            seen = set()
+        canonical, _ = url_index.add(cleaned_url, category, source='bl')
+        if canonical in seen:
+            duplicates += 1
+            continue
+        seen.add(canonical)
+        writer.writerow([cleaned_url, category])
+
+url_index.close()
+print(f"Data was written at {output_csv} file ({duplicates} duplicate URLs within a category skipped).")
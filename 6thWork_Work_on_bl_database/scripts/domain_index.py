@@ -0,0 +1,211 @@
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import numpy as np
+from urllib.parse import urlsplit
+
+from blacklist_archive import archive_path, iter_blacklist
+
+index_directory = '../data/domain_index'
+
+# Bloom filter size: bits per domain (10 bits and 7 probes ~ 1% false positives)
+bloom_bits_per_key = 10
+
+
+# 64-bit hash of a domain, the same at build and lookup time
+def domain_hash(domain):
+    return int.from_bytes(hashlib.blake2b(domain.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+# Host of a URL or a bare domain, lowercase without a trailing dot
+def host_of(url):
+    url = url.strip()
+    if '[' in url:
+        # IPv6 literals are left to urlsplit
+        return (urlsplit(url if '//' in url else '//' + url).hostname or '').rstrip('.')
+    start = url.find('//')
+    host = url[start + 2:] if start >= 0 else url
+    for separator in '/?#':
+        end = host.find(separator)
+        if end >= 0:
+            host = host[:end]
+    host = host.rpartition('@')[2].partition(':')[0]
+    return host.lower().rstrip('.')
+
+
+# The host and every parent domain, most specific first: a.shop.example.com -> shop.example.com -> ...
+# IP addresses only match themselves
+def domain_suffixes(host):
+    if not host:
+        return []
+    if ':' in host or host.replace('.', '').isdigit():
+        return [host]
+    labels = host.split('.')
+    return ['.'.join(labels[i:]) for i in range(len(labels)) if labels[i]]
+
+
+def _bloom_positions(hashes, bits, probes):
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    first = hashes & np.uint64(0xFFFFFFFF)
+    step = (hashes >> np.uint64(32)) | np.uint64(1)
+    return [(first + np.uint64(i) * step) % np.uint64(bits) for i in range(probes)]
+
+
+# Writing the index of (domain, category) pairs: sorted 64-bit domain hashes, the category ids of every domain
+# (CSR: category_offsets[i]:category_offsets[i + 1] of category_ids, any number of categories), the domains
+# themselves (for exact verification) and a Bloom filter, all as files which are memory-mapped
+def build_index(entries, directory=index_directory, bits_per_key=bloom_bits_per_key):
+    categories = {}
+    domain_categories = {}
+    for domain, category in entries:
+        domain = host_of(domain)
+        if not domain:
+            continue
+        category_id = categories.setdefault(category, len(categories))
+        domain_categories.setdefault(domain, set()).add(category_id)
+
+    domains = sorted(domain_categories, key=domain_hash)
+    hashes = np.array([domain_hash(domain) for domain in domains], dtype=np.uint64)
+    encoded = [domain.encode('utf-8') for domain in domains]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+    offsets[1:] = np.cumsum([len(domain) for domain in encoded])
+    category_ids = [sorted(domain_categories[domain]) for domain in domains]
+    category_offsets = np.zeros(len(domains) + 1, dtype=np.uint64)
+    category_offsets[1:] = np.cumsum([len(ids) for ids in category_ids])
+
+    bloom_bits = max(64, len(domains) * bits_per_key)
+    probes = max(1, round(bits_per_key * 0.693))
+    bloom = np.zeros((bloom_bits + 7) // 8, dtype=np.uint8)
+    for positions in _bloom_positions(hashes, bloom_bits, probes):
+        np.bitwise_or.at(bloom, (positions >> np.uint64(3)).astype(np.int64),
+                         (np.uint8(1) << (positions & np.uint64(7)).astype(np.uint8)))
+
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, 'hashes.npy'), hashes)
+    np.save(os.path.join(directory, 'category_offsets.npy'), category_offsets)
+    np.save(os.path.join(directory, 'category_ids.npy'),
+            np.array([i for ids in category_ids for i in ids], dtype=np.uint16))
+    np.save(os.path.join(directory, 'offsets.npy'), offsets)
+    np.save(os.path.join(directory, 'bloom.npy'), bloom)
+    with open(os.path.join(directory, 'domains.bin'), 'wb') as f:
+        f.write(b''.join(encoded))
+    with open(os.path.join(directory, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({'categories': list(categories), 'bloom_bits': bloom_bits, 'bloom_probes': probes}, f)
+    return len(domains)
+
+
+# Memory-mapped domain -> categories lookups with subdomain suffix matching: the most specific listed
+# domain wins (a.b.shop.example.com matches shop.example.com before example.com)
+class DomainIndex:
+    def __init__(self, directory=index_directory, use_bloom=True):
+        with open(os.path.join(directory, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.categories = meta['categories']
+        self.bloom_bits = meta['bloom_bits']
+        self.bloom_probes = meta['bloom_probes']
+        self.hashes = np.load(os.path.join(directory, 'hashes.npy'), mmap_mode='r')
+        self.category_offsets = np.load(os.path.join(directory, 'category_offsets.npy'), mmap_mode='r')
+        self.category_ids = np.load(os.path.join(directory, 'category_ids.npy'), mmap_mode='r')
+        self.offsets = np.load(os.path.join(directory, 'offsets.npy'), mmap_mode='r')
+        self.bloom = np.load(os.path.join(directory, 'bloom.npy'), mmap_mode='r') if use_bloom else None
+        with open(os.path.join(directory, 'domains.bin'), 'rb') as f:
+            self._domains = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(f.name) else b''
+        # Plain memoryviews of the mapped arrays for single lookups (no NumPy call overhead per probe)
+        self._hash_view = memoryview(self.hashes)
+        self._offset_view = memoryview(self.offsets)
+        self._bloom_view = memoryview(self.bloom) if self.bloom is not None else None
+        self._category_offset_view = memoryview(self.category_offsets)
+        self._category_id_view = memoryview(self.category_ids)
+
+    def _might_contain(self, h):
+        if self._bloom_view is None:
+            return True
+        first, step = h & 0xFFFFFFFF, (h >> 32) | 1
+        for i in range(self.bloom_probes):
+            position = (first + i * step) % self.bloom_bits
+            if not self._bloom_view[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def _domain_at(self, i):
+        return self._domains[self._offset_view[i]:self._offset_view[i + 1]].decode('utf-8')
+
+    # Categories of the domain at position i
+    def _categories_at(self, i):
+        start, end = self._category_offset_view[i], self._category_offset_view[i + 1]
+        return [self.categories[category_id] for category_id in self._category_id_view[start:end]]
+
+    def __len__(self):
+        return len(self.hashes)
+
+    # Categories of exactly this domain (no suffix matching), None when it is not listed
+    def get(self, domain):
+        h = domain_hash(domain)
+        i = bisect.bisect_left(self._hash_view, h)
+        if i < len(self._hash_view) and self._hash_view[i] == h and self._domain_at(i) == domain:
+            return self._categories_at(i)
+        return None
+
+    # Every (domain, categories) of the index, read from the mapped files one at a time
+    def items(self):
+        for i in range(len(self.hashes)):
+            yield self._domain_at(i), self._categories_at(i)
+
+    # (matched domain, categories) of a URL or host, None when no listed domain covers it
+    def lookup(self, url):
+        for suffix in domain_suffixes(host_of(url)):
+            h = domain_hash(suffix)
+            if not self._might_contain(h):
+                continue
+            i = bisect.bisect_left(self._hash_view, h)
+            if i < len(self._hash_view) and self._hash_view[i] == h and self._domain_at(i) == suffix:
+                return suffix, self._categories_at(i)
+        return None
+
+    # lookup() of many URLs at once: all suffixes are hashed into one array, filtered by the Bloom filter
+    # and searched with one vectorized binary search
+    def lookup_many(self, urls):
+        urls = list(urls)
+        results = [None] * len(urls)
+        owners = []
+        suffixes = []
+        for n, url in enumerate(urls):
+            for suffix in domain_suffixes(host_of(url)):
+                owners.append(n)
+                suffixes.append(suffix)
+        if not suffixes:
+            return results
+
+        hashes = np.array([domain_hash(suffix) for suffix in suffixes], dtype=np.uint64)
+        candidates = np.arange(len(hashes))
+        if self.bloom is not None:
+            passed = np.ones(len(hashes), dtype=bool)
+            for positions in _bloom_positions(hashes, self.bloom_bits, self.bloom_probes):
+                bytes_ = self.bloom[(positions >> np.uint64(3)).astype(np.int64)]
+                passed &= (bytes_ >> (positions & np.uint64(7)).astype(np.uint8)) & 1 == 1
+            candidates = candidates[passed]
+
+        found = np.searchsorted(self.hashes, hashes[candidates])
+        inside = found < len(self.hashes)
+        candidates, found = candidates[inside], found[inside]
+        hit = self.hashes[found] == hashes[candidates]
+        # Suffixes of a URL come most specific first, so the first verified hit of a URL is its match
+        for j, i in zip(candidates[hit].tolist(), found[hit].tolist()):
+            n = owners[j]
+            if results[n] is None and self._domain_at(i) == suffixes[j]:
+                results[n] = (suffixes[j], self._categories_at(i))
+        return results
+
+    def close(self):
+        if isinstance(self._domains, mmap.mmap):
+            self._domains.close()
+        self._hash_view = self._offset_view = self._bloom_view = None
+        self._category_offset_view = self._category_id_view = None
+        self.hashes = self.offsets = self.bloom = self.category_offsets = self.category_ids = None
+
+
+if __name__ == "__main__":
+    count = build_index(iter_blacklist(archive_path))
+    print(f"Domain index with {count} domains has been saved to {index_directory}.")
@@ -0,0 +1,32 @@
+import re
+
+# Separator between text nodes, no keyword can match across it
+node_separator = '\x00'
+
+
+# All keyword families matched by one compiled pattern in a single scan of the page text.
+# At every position the pattern finds the longest keyword starting there; every other keyword which
+# starts there is a prefix of it, so overlapping hits ('pay' inside 'payment') are counted as well.
+class KeywordMatcher:
+    def __init__(self, families):
+        self.families = {family: [keyword.lower() for keyword in keywords] for family, keywords in families.items()}
+        self.keywords = sorted({keyword for keywords in self.families.values() for keyword in keywords},
+                               key=len, reverse=True)
+        self._pattern = re.compile('(?=(' + '|'.join(re.escape(keyword) for keyword in self.keywords) + '))')
+        # Longest match -> all keywords matching at the same position
+        self._prefixes = {keyword: [other for other in self.keywords if keyword.startswith(other)]
+                          for keyword in self.keywords}
+
+    # Hit count of every keyword, text nodes are scanned separately like soup.find_all(string=...)
+    def count(self, texts):
+        hits = dict.fromkeys(self.keywords, 0)
+        text = node_separator.join(texts).lower()
+        for match in self._pattern.finditer(text):
+            for keyword in self._prefixes[match.group(1)]:
+                hits[keyword] += 1
+        return hits
+
+    # '1' / '0' flag of every family
+    def flags(self, hits):
+        return {family: '1' if any(hits[keyword] for keyword in keywords) else '0'
+                for family, keywords in self.families.items()}
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from urllib.parse import urlsplit, urlunsplit
+
+from requests.structures import CaseInsensitiveDict
+
+# Modules shared by all work folders
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'shared'))
+
+from page_snapshot import PageSnapshot
+
+cache_directory = '../data/page_cache'
+
+
+# Responses which are worth keeping (temporary errors are fetched again)
+def is_cacheable(status_code):
+    return status_code < 500 and status_code != 429
+
+
+class CacheMissError(Exception):
+    pass
+
+
+# Same page -> same key (lowercase scheme/host, no default port, no fragment)
+def normalize_url(url):
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower() or 'https'
+    host = (parts.hostname or '').rstrip('.')
+    port = parts.port
+    if port and (scheme, port) not in (('http', 80), ('https', 443)):
+        host = f"{host}:{port}"
+    return urlunsplit((scheme, host, parts.path or '/', parts.query, ''))
+
+
+# Persistent page store: sqlite index + compressed bodies stored once per content hash
+class PageCache:
+    def __init__(self, directory=cache_directory, ttl=30 * 24 * 3600, max_bytes=20 * 1024 ** 3, offline=False):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.join(directory, 'objects'), exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(directory, 'index.sqlite'), timeout=60, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('''CREATE TABLE IF NOT EXISTS pages (
+                                url TEXT PRIMARY KEY, final_url TEXT, status INTEGER, headers TEXT,
+                                encoding TEXT, content_hash TEXT, fetched_at REAL, accessed_at REAL)''')
+        self._db.execute('CREATE INDEX IF NOT EXISTS pages_accessed ON pages (accessed_at)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, size INTEGER, refs INTEGER)')
+        self._db.commit()
+        self._total_bytes = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+
+    def _blob_path(self, content_hash):
+        return os.path.join(self.directory, 'objects', content_hash[:2], content_hash)
+
+    # Cached snapshot of the url, None if missing or older than ttl (ttl is ignored in offline mode)
+    def get(self, url):
+        key = normalize_url(url)
+        with self._lock:
+            row = self._db.execute('SELECT final_url, status, headers, encoding, content_hash, fetched_at '
+                                   'FROM pages WHERE url = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            final_url, status, headers, encoding, content_hash, fetched_at = row
+            if not self.offline and time.time() - fetched_at > self.ttl:
+                return None
+            self._db.execute('UPDATE pages SET accessed_at = ? WHERE url = ?', (time.time(), key))
+            self._db.commit()
+        try:
+            with open(self._blob_path(content_hash), 'rb') as f:
+                content = zlib.decompress(f.read())
+        except (OSError, zlib.error):
+            return None
+        return PageSnapshot(final_url, status, CaseInsensitiveDict(json.loads(headers)), content, encoding)
+
+    # Like get, but a miss in offline mode raises CacheMissError instead of going to the network
+    def lookup(self, url):
+        snapshot = self.get(url)
+        if snapshot is None and self.offline:
+            raise CacheMissError(f"{url} is not in the page cache (offline mode)")
+        return snapshot
+
+    # Storing a snapshot under the requested url, bodies with the same content are stored once
+    def put(self, url, snapshot):
+        if not is_cacheable(snapshot.status_code):
+            return
+        key = normalize_url(url)
+        content_hash = hashlib.sha256(snapshot.content).hexdigest()
+        compressed = zlib.compress(snapshot.content)
+        path = self._blob_path(content_hash)
+        now = time.time()
+
+        with self._lock:
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(compressed)
+                os.replace(tmp_path, path)
+            size = len(compressed)
+
+            old = self._db.execute('SELECT content_hash FROM pages WHERE url = ?', (key,)).fetchone()
+            if old is not None and old[0] != content_hash:
+                self._release_blob(old[0])
+            if old is None or old[0] != content_hash:
+                known = self._db.execute('SELECT 1 FROM blobs WHERE hash = ?', (content_hash,)).fetchone()
+                self._db.execute('INSERT INTO blobs (hash, size, refs) VALUES (?, ?, 1) '
+                                 'ON CONFLICT(hash) DO UPDATE SET refs = refs + 1', (content_hash, size))
+                if known is None:
+                    self._total_bytes += size
+            self._db.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                             (key, snapshot.url, snapshot.status_code, json.dumps(dict(snapshot.headers)),
+                              snapshot.encoding, content_hash, now, now))
+            self._evict()
+            self._db.commit()
+
+    def _release_blob(self, content_hash):
+        self._db.execute('UPDATE blobs SET refs = refs - 1 WHERE hash = ?', (content_hash,))
+        refs, size = self._db.execute('SELECT refs, size FROM blobs WHERE hash = ?', (content_hash,)).fetchone()
+        if refs <= 0:
+            self._db.execute('DELETE FROM blobs WHERE hash = ?', (content_hash,))
+            self._total_bytes -= size
+            try:
+                os.remove(self._blob_path(content_hash))
+            except OSError:
+                pass
+
+    # Removing least recently used pages until the stored bodies fit in max_bytes
+    def _evict(self):
+        while self._total_bytes > self.max_bytes:
+            victims = self._db.execute('SELECT url, content_hash FROM pages ORDER BY accessed_at LIMIT 100').fetchall()
+            if not victims:
+                break
+            for url, content_hash in victims:
+                self._db.execute('DELETE FROM pages WHERE url = ?', (url,))
+                self._release_blob(content_hash)
+                if self._total_bytes <= self.max_bytes:
+                    break
+
+    def close(self):
+        with self._lock:
+            self._db.close()
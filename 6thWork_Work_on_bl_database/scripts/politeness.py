@@ -0,0 +1,344 @@
+import asyncio
+import email.utils
+import os
+import sys
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import requests
+import urllib3
+
+# Modules shared by all work folders
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'shared'))
+
+import http_session
+
+# Answers telling that a host (or its hosting provider) wants fewer requests
+throttle_statuses = (429, 503)
+
+
+def host_of(url):
+    return urlsplit(url).hostname or url
+
+
+# Retry-After header in seconds (delta-seconds or an HTTP date), None when there is none
+def retry_after_seconds(headers):
+    value = headers.get('Retry-After') if headers is not None else None
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, date.timestamp() - time.time())
+
+
+# Request budget of one host or one IP address
+class Budget:
+    __slots__ = ('limit', 'in_flight', 'not_before', 'failures', 'ip')
+
+    def __init__(self, limit):
+        self.limit = float(limit)
+        self.in_flight = 0
+        self.not_before = 0.0
+        self.failures = 0
+        self.ip = None
+
+
+# AIMD politeness policy. Every host has a concurrency limit which grows by about one request per
+# round of fast answers, shrinks when answers get slow and is halved on 429/503, resets and timeouts.
+# Other failures (DNS, refused or TLS errors) leave the limit as it is, only answers make it grow.
+# Retry-After (or an exponential backoff) pauses the host and min_interval spaces its requests.
+# IP addresses (learned from the connections) get their own budget, so hosts of one hosting provider
+# share a limit; they are only slowed down, never paused, because big CDNs serve many sites per IP.
+# Not thread-safe: the async scheduler uses it from the event loop, HostThrottle under its condition
+class PolitenessPolicy:
+    def __init__(self, per_host=4, max_per_host=16, per_ip=64, min_interval=0.0, latency_target=5.0,
+                 backoff=2.0, max_backoff=300.0, max_retries=2):
+        self.per_host = per_host
+        self.max_per_host = max_per_host
+        self.per_ip = per_ip
+        self.min_interval = min_interval
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retries = max_retries
+        self.throttled = 0
+        self.retried = 0
+        self._hosts = {}
+        self._ips = {}
+
+    # Seconds until a request to host may start: 0 = now, None = when one of its running requests ends.
+    # ip is the host's address when the caller knows it, otherwise the one of its last connection
+    def wait_time(self, host, now=None, ip=None):
+        host_budget = self._hosts.get(host)
+        if host_budget is not None and ip is None:
+            ip = host_budget.ip
+        if host_budget is None and ip is None:
+            return 0
+        now = time.monotonic() if now is None else now
+        wait = self._budget_wait(host_budget, now) if host_budget is not None else 0
+        ip_budget = self._ips.get(ip) if ip else None
+        if wait == 0 and ip_budget is not None:
+            wait = self._budget_wait(ip_budget, now)
+            # Only other hosts' requests are running on this IP, nothing of this host would wake it up
+            if wait is None and (host_budget is None or host_budget.in_flight == 0):
+                wait = 0.05
+        return wait
+
+    @staticmethod
+    def _budget_wait(budget, now):
+        if now < budget.not_before:
+            return budget.not_before - now
+        if budget.in_flight >= max(1, int(budget.limit)):
+            return None
+        return 0
+
+    def start(self, host):
+        budget = self._hosts.get(host)
+        if budget is None:
+            budget = self._hosts[host] = Budget(self.per_host)
+        budget.in_flight += 1
+        if self.min_interval:
+            budget.not_before = time.monotonic() + self.min_interval
+
+    # The request of host is connected to ip (the IP budget counts it from now on)
+    def connected(self, host, ip):
+        budget = self._ips.get(ip)
+        if budget is None:
+            budget = self._ips[ip] = Budget(self.per_ip)
+        budget.in_flight += 1
+        host_budget = self._hosts.get(host)
+        if host_budget is not None:
+            host_budget.ip = ip
+
+    # Request ended without reaching the host (e.g. answered from the page cache)
+    def cancel(self, host):
+        self._finish_budget(self._hosts, host, self.per_host, None)
+
+    # Updating the budgets with the outcome of a request, True when the host asked to slow down
+    def finish(self, host, ip=None, status=None, latency=None, retry_after=None, failed=False):
+        throttled = failed or status in throttle_statuses
+        if throttled:
+            self.throttled += 1
+        signal = (throttled, status is not None, latency, retry_after)
+        self._finish_budget(self._hosts, host, self.per_host, signal, pause=True)
+        if ip is not None:
+            self._finish_budget(self._ips, ip, self.per_ip, signal, pause=False)
+        return throttled
+
+    def _finish_budget(self, budgets, key, initial_limit, signal, pause=False):
+        budget = budgets.get(key)
+        if budget is None:
+            return
+        budget.in_flight -= 1
+        if signal is not None:
+            throttled, answered, latency, retry_after = signal
+            max_limit = self.max_per_host if budgets is self._hosts else initial_limit
+            if throttled:
+                # Multiplicative decrease, the host is left alone for Retry-After or a growing backoff
+                budget.failures += 1
+                budget.limit = max(1.0, budget.limit / 2)
+                if pause:
+                    delay = retry_after if retry_after is not None else self.backoff * 2 ** (budget.failures - 1)
+                    budget.not_before = max(budget.not_before, time.monotonic() + min(delay, self.max_backoff))
+            elif not answered:
+                # Failed without an overload signal: neither a decrease nor an increase
+                pass
+            elif latency is not None and latency > self.latency_target:
+                budget.limit = max(1.0, budget.limit * 0.75)
+            else:
+                # Additive increase: about +1 after a full window of fast answers
+                budget.failures = 0
+                budget.limit = min(max_limit, budget.limit + 1 / budget.limit)
+        # Healthy idle budgets are dropped, memory stays small for millions of hosts
+        if (budget.in_flight == 0 and budget.failures == 0 and budget.limit >= initial_limit
+                and budget.not_before <= time.monotonic()):
+            del budgets[key]
+
+    # Whether a throttled request should be sent again (not when the host wants a too long pause)
+    def should_retry(self, attempt, retry_after=None):
+        if attempt >= self.max_retries or (retry_after is not None and retry_after > self.max_backoff):
+            return False
+        self.retried += 1
+        return True
+
+
+# Dispatching rows to the async download workers host by host: every host has its own queue and the
+# workers take the next row of the next host which may get a request now (round-robin), so a throttled
+# or paused host never holds a worker while the rows of other hosts are waiting
+class HostScheduler:
+    def __init__(self, policy):
+        self.policy = policy
+        self._pending = {}
+        self._ready = deque()
+        self._queued = set()
+        self._timed = set()
+        self._waiters = deque()
+        self._active = 0
+        self._closed = False
+
+    def put(self, host, item, retry=False):
+        queue = self._pending.get(host)
+        if queue is None:
+            queue = self._pending[host] = deque()
+        if retry:
+            queue.appendleft(item)
+        else:
+            queue.append(item)
+        self._mark_ready(host)
+
+    # No more rows, the workers get None once every row is finished
+    def close(self):
+        self._closed = True
+        self._wake_all_if_finished()
+
+    # Next (host, item) with a request slot reserved for host, None when the crawl is over
+    async def get(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            for _ in range(len(self._ready)):
+                host = self._ready.popleft()
+                self._queued.discard(host)
+                queue = self._pending.get(host)
+                if not queue:
+                    continue
+                wait = self.policy.wait_time(host)
+                if wait == 0:
+                    self.policy.start(host)
+                    item = queue.popleft()
+                    if queue:
+                        self._mark_ready(host)
+                    else:
+                        del self._pending[host]
+                    self._active += 1
+                    return host, item
+                if wait is not None and host not in self._timed:
+                    self._timed.add(host)
+                    loop.call_later(wait, self._timer_fired, host)
+                # wait is None: the host is marked ready again when one of its requests is done
+
+            if self._closed and not self._pending and self._active == 0:
+                return None
+            waiter = loop.create_future()
+            self._waiters.append(waiter)
+            await waiter
+
+    # The request taken with get() has ended (finish/cancel the policy before calling this)
+    def done(self, host):
+        self._active -= 1
+        if host in self._pending:
+            self._mark_ready(host)
+        self._wake_all_if_finished()
+
+    def _timer_fired(self, host):
+        self._timed.discard(host)
+        if host in self._pending:
+            self._mark_ready(host)
+
+    def _mark_ready(self, host):
+        if host not in self._queued:
+            self._queued.add(host)
+            self._ready.append(host)
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+
+    def _wake_all_if_finished(self):
+        if self._closed and not self._pending and self._active == 0:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if not waiter.done():
+                    waiter.set_result(None)
+
+
+# Timeouts and connection resets (not DNS or TLS failures) are overload signals
+def is_overload_error(error):
+    if isinstance(error, requests.Timeout):
+        return True
+    reason = error.args[0] if isinstance(error, requests.ConnectionError) and error.args else None
+    return isinstance(reason, urllib3.exceptions.ProtocolError)
+
+
+# IP address of the server of a streamed response, None when its connection is already released
+def peer_ip(response):
+    try:
+        return response.raw._connection.sock.getpeername()[0]
+    except (AttributeError, OSError, IndexError, TypeError):
+        return None
+
+
+# Blocking front of the policy for the thread engine: http_session.get with per-host and per-IP AIMD limits,
+# Retry-After pauses and retries of throttled requests. requests does not expose the connection before the
+# answer, so the IP address of a host is learned from its first response and remembered (the max_hosts
+# most recent hosts); later requests of the host are counted on that IP while they run
+class HostThrottle:
+    def __init__(self, policy, max_hosts=100000):
+        self.policy = policy
+        self.max_hosts = max_hosts
+        self._condition = threading.Condition()
+        self._host_ips = {}
+
+    # Returns the IP address the request is counted on (None when the host's IP is not known yet)
+    def acquire(self, host):
+        with self._condition:
+            ip = self._host_ips.get(host)
+            while True:
+                wait = self.policy.wait_time(host, ip=ip)
+                if wait == 0:
+                    self.policy.start(host)
+                    if ip is not None:
+                        self.policy.connected(host, ip)
+                    return ip
+                self._condition.wait(wait)
+
+    def _learned(self, host, ip):
+        with self._condition:
+            self.policy.connected(host, ip)
+            self._host_ips.pop(host, None)
+            self._host_ips[host] = ip
+            if len(self._host_ips) > self.max_hosts:
+                del self._host_ips[next(iter(self._host_ips))]
+
+    def release(self, host, **signals):
+        with self._condition:
+            throttled = self.policy.finish(host, **signals)
+            self._condition.notify_all()
+        return throttled
+
+    def get(self, url, **kwargs):
+        host = host_of(url)
+        attempt = 0
+        while True:
+            ip = self.acquire(host)
+            started = time.monotonic()
+            try:
+                response = http_session.get(url, **kwargs)
+            except requests.RequestException as e:
+                overloaded = is_overload_error(e)
+                self.release(host, ip=ip, failed=overloaded)
+                with self._condition:
+                    retry = overloaded and self.policy.should_retry(attempt)
+                if not retry:
+                    raise
+            else:
+                if ip is None:
+                    ip = peer_ip(response)
+                    if ip is not None:
+                        self._learned(host, ip)
+                retry_after = retry_after_seconds(response.headers)
+                throttled = self.release(host, ip=ip, status=response.status_code,
+                                         latency=time.monotonic() - started, retry_after=retry_after)
+                with self._condition:
+                    retry = throttled and self.policy.should_retry(attempt, retry_after)
+                if not retry:
+                    return response
+                response.close()
+            attempt += 1
@@ -0,0 +1,143 @@
+import csv
+import os
+import shutil
+import sys
+
+from blacklist_archive import archive_path, iter_blacklist
+from domain_index import DomainIndex, build_index, host_of, index_directory
+
+# The domain index of the last merged release is the snapshot new releases are compared with. The index of
+# a diffed release waits next to it until its delta is merged
+snapshot_directory = index_directory
+pending_directory = snapshot_directory + '.new'
+
+data_directory = '../data'
+changes_csv = os.path.join(data_directory, "release_changes.csv")
+# Only the added domains have to be crawled, this file is the input of base_website_data.py
+delta_csv = os.path.join(data_directory, "url_and_categories_delta.csv")
+
+# Categories to take from the release, None takes all of them (e.g. ['shopping'])
+categories = None
+
+change_headers = ['Domain', 'Change', 'Old_Categories', 'New_Categories']
+
+
+# (domain, change, old categories, new categories) of every domain which is added, removed or
+# recategorized. Both releases are read from their memory-mapped indexes, one domain at a time
+def diff_releases(old_index, new_index):
+    for domain, new_categories in new_index.items():
+        old_categories = old_index.get(domain) if old_index is not None else None
+        if old_categories is None:
+            yield domain, 'added', [], new_categories
+        elif set(old_categories) != set(new_categories):
+            yield domain, 'recategorized', old_categories, new_categories
+    if old_index is not None:
+        for domain, old_categories in old_index.items():
+            if new_index.get(domain) is None:
+                yield domain, 'removed', old_categories, []
+
+
+# Writing the change list and the crawl delta, returns the number of domains per change
+def write_changes(changes, categories=None):
+    counts = {'added': 0, 'removed': 0, 'recategorized': 0}
+    with open(changes_csv, mode='w', newline='', encoding='utf-8') as changes_file, \
+            open(delta_csv, mode='w', newline='', encoding='utf-8') as delta_file:
+        changes_writer = csv.writer(changes_file)
+        changes_writer.writerow(change_headers)
+        delta_writer = csv.writer(delta_file)
+        delta_writer.writerow(['URL', 'Category'])
+
+        for domain, change, old_categories, new_categories in changes:
+            if categories is not None and not set(categories) & set(old_categories + new_categories):
+                continue
+            counts[change] += 1
+            changes_writer.writerow([domain, change, ';'.join(old_categories), ';'.join(new_categories)])
+            if change == 'added':
+                wanted = [category for category in new_categories if categories is None or category in categories]
+                delta_writer.writerow([domain, wanted[0]])
+    return counts
+
+
+# Comparing a new release with the snapshot. The new release only becomes the snapshot when its delta is
+# merged (promote_snapshot), so diffing again before that gives the same changes instead of an empty diff
+def ingest_release(source=archive_path, categories=None):
+    build_index(iter_blacklist(source), pending_directory)
+
+    old_index = DomainIndex(snapshot_directory) if os.path.exists(snapshot_directory) else None
+    new_index = DomainIndex(pending_directory)
+    counts = write_changes(diff_releases(old_index, new_index), categories)
+    new_index.close()
+    if old_index is not None:
+        old_index.close()
+    return counts
+
+
+# The diffed release becomes the snapshot, returns False when no release is waiting
+def promote_snapshot():
+    if not os.path.exists(pending_directory):
+        return False
+    if os.path.exists(snapshot_directory):
+        shutil.rmtree(snapshot_directory)
+    os.replace(pending_directory, snapshot_directory)
+    return True
+
+
+# Change and new categories of every changed domain (the change list is small, it is kept in memory)
+def read_changes(path=changes_csv):
+    changes = {}
+    with open(path, mode='r', newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            new_categories = row['New_Categories'].split(';') if row['New_Categories'] else []
+            changes[row['Domain']] = (row['Change'], new_categories)
+    return changes
+
+
+# Merging the crawl results of the delta into an existing dataset (URL and Category columns first):
+# rows of removed domains are dropped, recategorized rows get their new category, rows of added domains
+# come from the delta results. The dataset is rewritten in one pass and replaced at the end, then the diffed
+# release becomes the snapshot
+def merge_delta(dataset_csv, delta_results_csv, path=changes_csv, promote=True):
+    changes = read_changes(path)
+    counts = {'kept': 0, 'removed': 0, 'recategorized': 0, 'added': 0}
+    tmp_path = dataset_csv + '.tmp'
+    with open(dataset_csv, mode='r', newline='', encoding='utf-8') as infile, \
+            open(tmp_path, mode='w', newline='', encoding='utf-8') as outfile:
+        reader = csv.DictReader(infile)
+        writer = csv.DictWriter(outfile, fieldnames=reader.fieldnames)
+        writer.writeheader()
+
+        for row in reader:
+            change = changes.get(host_of(row['URL']))
+            if change is not None:
+                kind, new_categories = change
+                # Added again after an earlier removal: the fresh delta result replaces the old row
+                if kind in ('removed', 'added'):
+                    counts['removed'] += kind == 'removed'
+                    continue
+                if row['Category'] not in new_categories:
+                    row['Category'] = new_categories[0]
+                    counts['recategorized'] += 1
+            counts['kept'] += 1
+            writer.writerow(row)
+
+        if os.path.exists(delta_results_csv):
+            with open(delta_results_csv, mode='r', newline='', encoding='utf-8') as delta_file:
+                for row in csv.DictReader(delta_file):
+                    writer.writerow({field: row.get(field, 'N/A') for field in reader.fieldnames})
+                    counts['added'] += 1
+    os.replace(tmp_path, dataset_csv)
+    if promote:
+        promote_snapshot()
+    return counts
+
+
+if __name__ == "__main__":
+    # python release_diff.py diff [release archive]
+    # python release_diff.py merge <dataset csv> <crawl results of the delta csv>
+    if len(sys.argv) > 1 and sys.argv[1] == 'merge':
+        counts = merge_delta(sys.argv[2], sys.argv[3])
+        print(f"Delta results have been merged into {sys.argv[2]}: {counts}")
+    else:
+        counts = ingest_release(sys.argv[2] if len(sys.argv) > 2 else archive_path, categories)
+        print(f"Release changes have been saved to {changes_csv}, domains to crawl to {delta_csv}: {counts}. "
+              f"The release becomes the snapshot when the delta is merged.")
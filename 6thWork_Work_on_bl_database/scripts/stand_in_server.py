@@ -0,0 +1,99 @@
+import asyncio
+import random
+import threading
+
+# Canned pages for trying the crawl scripts without touching real websites
+default_pages = {
+    '/': (200, 'text/html; charset=utf-8',
+          '<html lang="en"><head><title>Stand-in Shop</title>'
+          '<meta name="description" content="Canned page for crawler tests"></head>'
+          '<body><h1>Shop</h1><h2>Offers</h2><a href="/a">a</a><a href="/b">b</a><img src="x.png">'
+          '<p>Checkout with credit card. Login to your account and read the reviews.</p>'
+          '<iframe src="/ad"></iframe></body></html>'),
+    '/404': (404, 'text/html; charset=utf-8', '<html><body>Not found</body></html>'),
+}
+
+reasons = {200: 'OK', 404: 'Not Found', 429: 'Too Many Requests', 500: 'Internal Server Error',
+           503: 'Service Unavailable'}
+
+
+# Answering one keep-alive connection, every response is delayed by latency (+ random jitter) seconds.
+# With max_concurrent, requests above that many at the same time get 429 with Retry-After (like a busy host)
+async def handle_connection(reader, writer, pages, latency, jitter, max_concurrent=None, busy=None):
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            method, path = request_line.decode('latin-1').split()[:2]
+            keep_alive = True
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                if line.lower().startswith(b'connection:') and b'close' in line.lower():
+                    keep_alive = False
+
+            extra_headers = ''
+            if max_concurrent is not None and busy[0] >= max_concurrent:
+                status, content_type, body = 429, 'text/plain', 'Too many requests'
+                extra_headers = 'Retry-After: 1\r\n'
+            else:
+                status, content_type, body = pages.get(path.split('?')[0], pages['/'])
+            if busy is not None:
+                busy[0] += 1
+            try:
+                await asyncio.sleep(latency + random.uniform(0, jitter))
+            finally:
+                if busy is not None:
+                    busy[0] -= 1
+
+            body = body.encode('utf-8')
+            head = (f"HTTP/1.1 {status} {reasons.get(status, 'Unknown')}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"{extra_headers}"
+                    f"Content-Length: {len(body)}\r\n"
+                    f"Set-Cookie: session=stand-in\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+            writer.write(head.encode('latin-1'))
+            if method != 'HEAD':
+                writer.write(body)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(pages=None, host='127.0.0.1', port=8000, latency=0.2, jitter=0.0, ready=None, max_concurrent=None):
+    pages = pages or default_pages
+    busy = [0]
+    server = await asyncio.start_server(
+        lambda r, w: handle_connection(r, w, pages, latency, jitter, max_concurrent, busy), host, port, backlog=4096)
+    if ready is not None:
+        ready(server.sockets[0].getsockname()[1])
+    async with server:
+        await server.serve_forever()
+
+
+# Starting the server in a daemon thread, returns the bound port (port=0 picks a free one)
+def start_in_thread(pages=None, host='127.0.0.1', port=0, latency=0.2, jitter=0.0, max_concurrent=None):
+    started = threading.Event()
+    bound = []
+
+    def ready(bound_port):
+        bound.append(bound_port)
+        started.set()
+
+    thread = threading.Thread(
+        target=lambda: asyncio.run(serve(pages, host, port, latency, jitter, ready, max_concurrent)), daemon=True)
+    thread.start()
+    started.wait()
+    return bound[0]
+
+
+if __name__ == "__main__":
+    print("Stand-in server listening on http://127.0.0.1:8000 (latency 0.2s)")
+    asyncio.run(serve())
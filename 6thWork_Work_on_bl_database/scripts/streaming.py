@@ -0,0 +1,41 @@
+import concurrent.futures
+import itertools
+from collections import deque
+
+
+# Like executor.map, but at most `window` rows are read ahead of the writer (backpressure to the reader)
+# and results are yielded as soon as they finish, ordered=True restores the input order
+def bounded_map(executor, fn, iterable, window=200, ordered=False):
+    iterator = iter(iterable)
+
+    if ordered:
+        pending = deque(executor.submit(fn, item) for item in itertools.islice(iterator, window))
+        while pending:
+            result = pending.popleft().result()
+            for item in itertools.islice(iterator, 1):
+                pending.append(executor.submit(fn, item))
+            yield result
+        return
+
+    pending = {executor.submit(fn, item) for item in itertools.islice(iterator, window)}
+    while pending:
+        done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
+        for item in itertools.islice(iterator, len(done)):
+            pending.add(executor.submit(fn, item))
+
+
+# Buffer which gives back results in input order (results are added with their input index)
+class Reorderer:
+    def __init__(self):
+        self.next_index = 0
+        self._buffer = {}
+
+    def add(self, index, item):
+        self._buffer[index] = item
+        ready = []
+        while self.next_index in self._buffer:
+            ready.append(self._buffer.pop(self.next_index))
+            self.next_index += 1
+        return ready
@@ -0,0 +1,35 @@
+import asyncio
+
+import aiohttp
+
+import stand_in_server
+from async_crawler import PeerConnector, fetch_snapshot_async, run_crawl
+from politeness import PolitenessPolicy
+
+
+# Regression: a busy host answers 429 with a text/plain body and Retry-After. The answer must reach the
+# politeness policy as throttling (and the row be sent again) instead of being dropped as unwanted content
+def test_plain_text_429_is_retried():
+    port = stand_in_server.start_in_thread(latency=0.05, max_concurrent=2)
+    rows = [{'URL': f'http://127.0.0.1:{port}/?row={i}'} for i in range(40)]
+    results = []
+    policy = PolitenessPolicy(per_host=4)
+    run_crawl(rows, lambda row, snapshot: snapshot.status_code, lambda row, result, final: results.append(result),
+              concurrency=8, politeness=policy)
+    assert policy.throttled > 0
+    assert results == [200] * len(rows)
+
+
+# Regression: the IP address of the server reaches on_connect for small pages too (their connection is
+# released before the response is returned)
+def test_peer_ip_of_small_page():
+    port = stand_in_server.start_in_thread(latency=0)
+    connected = []
+
+    async def fetch():
+        async with aiohttp.ClientSession(connector=PeerConnector()) as session:
+            for _ in range(2):
+                await fetch_snapshot_async(session, f'http://127.0.0.1:{port}/', connected.append)
+
+    asyncio.run(fetch())
+    assert connected == ['127.0.0.1', '127.0.0.1']
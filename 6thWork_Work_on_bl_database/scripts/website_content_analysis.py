@@ -1,14 +1,26 @@
-import requests
-from bs4 import BeautifulSoup
 import csv
 import os
-import whois
 from datetime import datetime
 import concurrent.futures
+import sys
 import time
 import logging
 from logging.handlers import TimedRotatingFileHandler
 
+# Modules shared by all work folders
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'shared'))
+
+from page_snapshot import fetch_snapshot
+from keyword_matcher import KeywordMatcher
+from whois_cache import WhoisCache, WhoisLane, lookup_creation_date, registered_domain
+from async_crawler import run_crawl
+from politeness import HostThrottle, PolitenessPolicy
+from page_cache import PageCache
+from streaming import bounded_map
+from crawl_journal import CrawlJournal, JournaledWriter, is_final, journal_key, open_resumable_csv
+from url_index import UrlIndex
+from columnar import open_rows
+
 logger = logging.getLogger(f"website_content_analysis")
 logger.setLevel(logging.INFO)
 
@@ -29,9 +41,63 @@ logger.addHandler(handler)
 end_time = datetime.now()
 
 data_directory = '../data'
+# The input may also be a columnar table (a path ending with .table, see columnar.py)
 input_csv_file = os.path.join(data_directory, "url_meta_info_shp.csv")
 output_csv_file = os.path.join(data_directory, "website_content_analysis_shp.csv")
 
+# Journal of finished URLs, resume=False starts the output from scratch
+journal_file = output_csv_file + '.journal'
+resume = True
+
+# Crawl engine ('async' or 'threads') and its limits
+crawl_engine = 'async'
+max_concurrency = 2000
+per_host_concurrency = 4
+
+# Politeness per host: the concurrency of a host adapts between 1 and max_per_host (AIMD, starting at
+# per_host_concurrency), Retry-After is respected and throttled rows are sent again up to max_retries times
+max_per_host = 16
+max_retries = 2
+politeness = None
+host_throttle = None
+
+# Index of canonical URLs: a page which already has a content record (found under another category or in an
+# earlier run) is answered from the index instead of being downloaded again. Not used with preserve_order,
+# answers from the index would be written ahead of the rows in flight
+use_url_index = True
+url_index = None
+
+# Page bodies are streamed and cut at this size, answers which are not HTML are skipped from their headers
+max_page_bytes = 2 * 1024 ** 2
+
+# Rows read ahead of the writer (memory stays flat for any input size), results are written
+# as they finish unless preserve_order is set
+max_in_flight = 4000
+preserve_order = False
+
+# Parsing and feature extraction run in a process pool sized to the cores, the download workers only
+# fetch and wait for the results (at most one page per download worker is queued). 0 parses in the
+# download threads
+parse_workers = os.cpu_count()
+parse_pool = None
+
+# WHOIS results cache (per registered domain) and the rate-limited WHOIS lane
+whois_cache_file = os.path.join(data_directory, "whois_cache.sqlite")
+whois_workers = 4
+whois_rate = 2.0
+whois_lane = None
+
+# Domain_Age is not waited for during the crawl (the WHOIS lane is far slower than the downloads): an answer
+# which is not there after whois_wait seconds is written as 'N/A' and filled in by fill_domain_ages afterwards
+whois_wait = 0.05
+whois_join_threads = 64
+
+# Downloaded pages are kept in ../data/page_cache and shared by both crawl stages,
+# offline_mode only reads from this cache (no network)
+use_page_cache = True
+offline_mode = False
+page_cache = None
+
 # Adding New Features
 new_headers = ['Word_Count', 'Link_Count', 'Image_Count', 'Video_Count', 'Has_Ads', 'Domain_Age', 'Payment_Present',
                'Login_Present', 'User_Comments', 'Cookies_Present', 'H1_Count', 'H2_Count']
@@ -40,81 +106,79 @@ new_headers = ['Word_Count', 'Link_Count', 'Image_Count', 'Video_Count', 'Has_Ad
 headers = ['URL', 'Category', 'Language', 'Title', 'Meta_Description'] + new_headers
 
 
-# Getting Domain Age
-def get_domain_age(url):
+# WHOIS lookups are submitted when a row is dispatched, so they run while its page is downloaded and parsed
+def prefetch_whois(rows):
+    for row in rows:
+        whois_lane.submit(row['URL'])
+        yield row
+
+
+# Getting Domain Age (WHOIS answers are cached per registered domain and queried in their own lane,
+# the lookup prefetched at dispatch is picked up here). With `wait`, 'N/A' when the answer takes longer
+def get_domain_age(url, wait=None):
     try:
-        domain_info = whois.whois(url)
-        creation_date = domain_info.creation_date
+        if whois_lane is not None:
+            creation_date = whois_lane.submit(url).result(wait)
+        else:
+            creation_date = lookup_creation_date(registered_domain(url))
         if creation_date:
-            if isinstance(creation_date, list):
-                creation_date = creation_date[0]
             age = (datetime.now() - creation_date).days // 365
             return age
         else:
             return 'N/A'
+    except concurrent.futures.TimeoutError:
+        return 'N/A'
     except Exception as e:
         logger.error(f"Exception : {e}")
         return 'N/A'
 
 
+# Keyword families of Payment_Present, Login_Present and User_Comments, all matched in one scan of the page text
+keyword_families = {
+    'payment': ['pay', 'credit card', 'checkout', 'payment'],
+    'login': ['login', 'sign in', 'account'],
+    'comments': ['comments', 'review', 'feedback'],
+}
+keyword_matcher = KeywordMatcher(keyword_families)
+
+
+def keyword_flags(snapshot):
+    return keyword_matcher.flags(snapshot.keyword_hits(keyword_matcher))
+
+
 # Checking Payment
-def has_payment_system(url):
+def has_payment_system(snapshot):
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'}
-        response = requests.get(url, headers=headers, timeout=12)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        keywords = ['pay', 'credit card', 'checkout', 'payment']
-        for keyword in keywords:
-            if soup.find_all(string=lambda text: keyword in text.lower()):
-                return '1'
-        return '0'
+        return keyword_flags(snapshot)['payment']
     except Exception as e:
         logger.error(f"Exception : {e}")
         return 'N/A'
 
 
 # Checking login
-def has_login(url):
+def has_login(snapshot):
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'}
-        response = requests.get(url, headers=headers, timeout=12)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        if soup.find('input', {'type': 'password'}):
+        if snapshot.counts.password_inputs:
             return '1'
-        keywords = ['login', 'sign in', 'account']
-        for keyword in keywords:
-            if soup.find_all(string=lambda text: keyword in text.lower()):
-                return '1'
-        return '0'
+        return keyword_flags(snapshot)['login']
     except Exception as e:
         logger.error(f"Exception : {e}")
         return 'N/A'
 
 
 # Checking comments
-def has_user_comments(url):
+def has_user_comments(snapshot):
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'}
-        response = requests.get(url, headers=headers, timeout=12)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        keywords = ['comments', 'review', 'feedback']
-        for keyword in keywords:
-            if soup.find_all(string=lambda text: keyword in text.lower()):
-                return '1'
-        return '0'
+        return keyword_flags(snapshot)['comments']
     except Exception as e:
         logger.error(f"Exception : {e}")
         return 'N/A'
 
 
 # Checking Cookies
-def has_cookies(url):
+def has_cookies(snapshot):
     try:
-        response = requests.get(url, timeout=12)
-        if 'set-cookie' in response.headers:
+        if 'set-cookie' in snapshot.headers:
             return '1'
         return '0'
     except Exception as e:
@@ -122,37 +186,28 @@ def has_cookies(url):
         return 'N/A'
 
 
-# Checking Word_Count, Link_Count, Image_Count, Video_Count, Has_Ads, H1/H2_counts
-def analyze_website_content(url):
+# Checking Word_Count, Link_Count, Image_Count, Video_Count, Has_Ads, H1/H2_counts (one pass, no tree)
+def analyze_website_content(snapshot):
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'}
-        response = requests.get(url, headers=headers, timeout=12)
-        response.raise_for_status()
-
-        # Getting content with BeautifulSoup
-        soup = BeautifulSoup(response.text, 'html.parser')
+        snapshot.raise_for_status()
 
-        # Word Count
-        text = soup.get_text()
-        words = text.split()
-        word_count = len(words)
+        counts = snapshot.counts
+        tag_counts = counts.tag_counts
 
-        # Link Count
-        link_count = len(soup.find_all('a'))
+        # Word Count (same as len(soup.get_text().split()))
+        word_count = counts.word_count
 
-        # Image Count
-        image_count = len(soup.find_all('img'))
-
-        # Video Count
-        video_count = len(soup.find_all('video'))
+        # Link, Image and Video Count
+        link_count = tag_counts['a']
+        image_count = tag_counts['img']
+        video_count = tag_counts['video']
 
         # Has Ads
-        has_ads = '1' if soup.find_all(['iframe', 'ins', 'ad']) else '0'
+        has_ads = '1' if tag_counts['iframe'] or tag_counts['ins'] or tag_counts['ad'] else '0'
 
         # H1 and H2 Tag Counts
-        h1_count = len(soup.find_all('h1'))
-        h2_count = len(soup.find_all('h2'))
+        h1_count = tag_counts['h1']
+        h2_count = tag_counts['h2']
 
         return word_count, link_count, image_count, video_count, has_ads, h1_count, h2_count
 
@@ -161,22 +216,37 @@ def analyze_website_content(url):
         return 'N/A', 'N/A', 'N/A', 'N/A', 'N/A', 'N/A', 'N/A'
 
 
-# Main process for each URL
-def process_url(row):
+# Features which only need the page itself (CPU-bound, may run in a parse process)
+def page_features(snapshot):
+    word_count, link_count, image_count, video_count, has_ads, h1_count, h2_count = analyze_website_content(snapshot)
+
+    # No need to check the rest when the content features are 'N/A', the row is skipped anyway
+    if 'N/A' in [word_count, link_count, image_count, video_count, has_ads, h1_count, h2_count]:
+        return None
+
+    return (word_count, link_count, image_count, video_count, has_ads, h1_count, h2_count,
+            has_payment_system(snapshot), has_login(snapshot), has_user_comments(snapshot), has_cookies(snapshot))
+
+
+# Extracting all features of a row from its downloaded page
+def extract_features(row, snapshot):
     url = row['URL']
 
-    word_count, link_count, image_count, video_count, has_ads, h1_count, h2_count = analyze_website_content(url)
+    # The raw page is handed to the parse processes, this thread only waits for the result
+    if parse_pool is not None:
+        features = parse_pool.submit(page_features, snapshot).result()
+    else:
+        features = page_features(snapshot)
 
     # Check if any of the new headers are 'N/A'. If so, skip this URL.
-    if 'N/A' in [word_count, link_count, image_count, video_count, has_ads, h1_count, h2_count]:
+    if features is None:
         logger.info(f"Skipping {url} due to being N/A for some features.")
         return None  # Skip this row
 
-    domain_age = get_domain_age(url)
-    payment_present = has_payment_system(url)
-    login_present = has_login(url)
-    user_comments = has_user_comments(url)
-    cookies_present = has_cookies(url)
+    (word_count, link_count, image_count, video_count, has_ads, h1_count, h2_count,
+     payment_present, login_present, user_comments, cookies_present) = features
+
+    domain_age = get_domain_age(url, whois_wait)
 
     new_row = [
         row['URL'], row['Category'], row['Language'],
@@ -188,19 +258,121 @@ def process_url(row):
     return new_row
 
 
-# Reading CSV and processing with multi-threading
-with open(input_csv_file, mode='r', newline='', encoding='ISO-8859-1') as infile, \
-        open(output_csv_file, mode='w', newline='', encoding='utf-8') as outfile:
-    reader = csv.DictReader(infile)
-    writer = csv.writer(outfile)
+# Join pass after the crawl: 'N/A' Domain_Age values of the output are filled from the WHOIS lane (answers
+# which came in while the crawl ran are cached). The file is rewritten in one pass, in order and with at most
+# `window` rows in memory, and replaced at the end. Returns the number of filled rows
+def fill_domain_ages(path, window=max_in_flight):
+    age_column = headers.index('Domain_Age')
+    filled = [0]
+
+    def fill(record):
+        if len(record) == len(headers) and record[age_column] == 'N/A':
+            record[age_column] = get_domain_age(record[0])
+            filled[0] += record[age_column] != 'N/A'
+        return record
+
+    tmp_path = path + '.tmp'
+    with open(path, mode='r', newline='', encoding='utf-8') as infile, \
+            open(tmp_path, mode='w', newline='', encoding='utf-8') as outfile, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=whois_join_threads) as executor:
+        reader = csv.reader(infile)
+        writer = csv.writer(outfile)
+        writer.writerow(next(reader))
+        for record in bounded_map(executor, fill, reader, window=window, ordered=True):
+            writer.writerow(record)
+    os.replace(tmp_path, path)
+    return filled[0]
+
+
+# Main process for each URL (the page is downloaded and parsed only once), returns (result, final)
+def process_url(row):
+    url = row['URL']
+
+    try:
+        snapshot = fetch_snapshot(url, timeout=12, cache=page_cache, throttle=host_throttle, max_bytes=max_page_bytes)
+    except Exception as e:
+        logger.error(f"Exception : {e}")
+        logger.info(f"Skipping {url} due to download error.")
+        return None, is_final(None, e)
+
+    try:
+        return extract_features(row, snapshot), is_final(snapshot)
+    except Exception as e:
+        logger.error(f"Exception while extracting {url}: {e!r}")
+        return None, False
+
+
+if __name__ == "__main__":
+    # The parse processes are forked first, while no thread, event loop or sqlite connection exists yet:
+    # the pool starts all its workers on its first task, so one no-op is waited for here
+    if parse_workers:
+        parse_pool = concurrent.futures.ProcessPoolExecutor(max_workers=parse_workers)
+        parse_pool.submit(int).result()
+    if use_page_cache:
+        page_cache = PageCache(offline=offline_mode)
+    whois_lane = WhoisLane(WhoisCache(whois_cache_file), workers=whois_workers, rate=whois_rate, logger=logger)
+
+    politeness = PolitenessPolicy(per_host=per_host_concurrency, max_per_host=max_per_host,
+                                  max_retries=max_retries)
+    host_throttle = HostThrottle(politeness)
+
+    if use_url_index and not preserve_order:
+        url_index = UrlIndex()
+
+    # Finished URLs are journaled, a restarted run skips them and appends to the existing output
+    journal = CrawlJournal(journal_file)
+
+    # Reading CSV and processing with asyncio (or the older multi-threading mode)
+    with open_rows(input_csv_file, encoding='ISO-8859-1') as (_, reader), \
+            open_resumable_csv(output_csv_file, headers, journal, ('URL', 'Category'), resume=resume) as outfile:
+        output = JournaledWriter(outfile, journal)
+        # A URL listed under several categories has one row per category, the journal keeps them apart
+        rows = journal.pending(reader, key_for=lambda row: journal_key(row['URL'], row['Category']))
+
+        # Rows which failed for a reason which may go away (final False) are not journaled, a restart retries them
+        def handle_result(row, result, final=True, from_index=False):
+            output.write(journal_key(row['URL'], row['Category']), result, final)
+            if url_index is not None and result is not None and not from_index:
+                url_index.put_record(row['URL'], 'content', result[5:])
+
+        # Rows whose page has a content record are written right away, the others go to the crawl
+        def rows_to_fetch(rows):
+            for row in rows:
+                url_index.add(row['URL'], row['Category'], source='crawl')
+                found, record = url_index.get_record(row['URL'], 'content')
+                if found:
+                    new_row = [row['URL'], row['Category'], row['Language'], row['Title'], row['Meta_Description']]
+                    handle_result(row, new_row + record, from_index=True)
+                else:
+                    yield row
+
+        if url_index is not None:
+            rows = rows_to_fetch(rows)
+        rows = prefetch_whois(rows)
+
+        if crawl_engine == 'async':
+            # Extraction threads wait for the parse processes and at most whois_wait seconds for WHOIS
+            run_crawl(rows, extract_features, handle_result, concurrency=max_concurrency,
+                      per_host=per_host_concurrency, timeout=12, extract_workers=100, cache=page_cache,
+                      window=max_in_flight, ordered=preserve_order, politeness=politeness,
+                      max_bytes=max_page_bytes, logger=logger)
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=100) as executor:
+                results = bounded_map(executor, lambda row: (row, process_url(row)), rows,
+                                      window=max_in_flight, ordered=preserve_order)
 
-    writer.writerow(headers)
+                for row, (result, final) in results:
+                    handle_result(row, result, final)
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=100) as executor:
-        results = executor.map(process_url, reader)
+        output.flush()
+    journal.close()
 
-        for result in results:
-            if result is not None:
-                writer.writerow(result)
+    # Domain ages which were not there during the crawl
+    logger.info(f"Domain_Age filled in for {fill_domain_ages(output_csv_file)} rows after the crawl")
+    if url_index is not None:
+        url_index.close()
+    if parse_pool is not None:
+        parse_pool.shutdown()
+    whois_lane.shutdown()
 
-print(f"Content analysis has been saved to {output_csv_file}. {end_time}")
+    print(f"Content analysis has been saved to {output_csv_file}. {end_time}")
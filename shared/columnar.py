@@ -0,0 +1,346 @@
+import contextlib
+import csv
+import json
+import os
+import sys
+import numpy as np
+
+# Stage outputs whose path ends with this suffix are columnar tables (a directory), others stay CSV
+table_suffix = '.table'
+
+# Rows per chunk: every chunk has its own files and min/max statistics, so filters can skip whole chunks
+chunk_rows = 10000
+
+# Values the crawl scripts write for a missing field, they become NaN in numeric columns
+na_values = ('N/A', '')
+
+# Column kinds from the narrowest to the widest, a column takes the widest kind any chunk needed
+kinds = ('int', 'float', 'str')
+
+operators = ('==', '!=', '<', '<=', '>', '>=', 'in', 'not in')
+
+
+def is_table(path):
+    return path.rstrip('/\\').endswith(table_suffix)
+
+
+# Typed array of one column of a chunk: int64 when every value is an integer, float64 (NaN for missing
+# values) when every value is a number, unicode strings otherwise
+def to_array(values):
+    values = list(values)
+    if values and all(isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, bool)
+                      for value in values):
+        array = np.asarray(values)
+        return array.astype(np.int64) if array.dtype.kind in 'iu' else array.astype(np.float64)
+    values = ['N/A' if value is None else str(value) for value in values]
+    present = [value for value in values if value not in na_values]
+    try:
+        numbers = [int(value) for value in present]
+        if len(present) == len(values):
+            return np.array(numbers, dtype=np.int64)
+        return np.array([np.nan if value in na_values else float(value) for value in values], dtype=np.float64)
+    except ValueError:
+        pass
+    try:
+        [float(value) for value in present]
+        return np.array([np.nan if value in na_values else float(value) for value in values], dtype=np.float64)
+    except ValueError:
+        return np.array(values, dtype=str)
+
+
+def kind_of(array):
+    if array.dtype.kind in 'iu':
+        return 'int'
+    if array.dtype.kind == 'f':
+        return 'float'
+    return 'str'
+
+
+# Array of a chunk as the kind of its column (a column which became wider in a later chunk)
+def as_kind(array, kind):
+    if kind_of(array) == kind:
+        return array
+    if kind == 'float':
+        return array.astype(np.float64)
+    if array.dtype.kind == 'f':
+        return np.array([_text(value) for value in array.tolist()], dtype=str)
+    return array.astype(str)
+
+
+def _stats(array):
+    if array.dtype.kind == 'f':
+        present = array[~np.isnan(array)]
+        return [present.min().item(), present.max().item()] if len(present) else None
+    if len(array) == 0:
+        return None
+    if array.dtype.kind == 'U':
+        values = array.tolist()
+        return [min(values), max(values)]
+    return [array.min().item(), array.max().item()]
+
+
+# Columnar table: a directory with schema.json and one .npy file per column and chunk.
+# Rows are buffered and written chunk by chunk, write_columns() takes whole column arrays at once
+class TableWriter:
+    def __init__(self, path, columns, rows_per_chunk=chunk_rows):
+        self.path = path
+        self.columns = list(columns)
+        self.rows_per_chunk = rows_per_chunk
+        self.kinds = {}
+        self.chunks = []
+        self._rows = []
+        os.makedirs(path, exist_ok=True)
+        for name in os.listdir(path):
+            if name.endswith('.npy') or name == 'schema.json':
+                os.remove(os.path.join(path, name))
+
+    def writeheader(self):
+        pass
+
+    # A row as a dict (like csv.DictWriter) or as a list in column order (like csv.writer)
+    def writerow(self, row):
+        if isinstance(row, dict):
+            row = [row.get(column) for column in self.columns]
+        self._rows.append(row)
+        if len(self._rows) >= self.rows_per_chunk:
+            self.flush()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def flush(self):
+        if self._rows:
+            rows, self._rows = self._rows, []
+            self.write_columns({column: [row[i] for row in rows] for i, column in enumerate(self.columns)})
+
+    def write_columns(self, columns):
+        arrays = [columns[column] if isinstance(columns[column], np.ndarray) else to_array(columns[column])
+                  for column in self.columns]
+        number = len(self.chunks)
+        stats = {}
+        for i, (column, array) in enumerate(zip(self.columns, arrays)):
+            kind = kind_of(array)
+            if kinds.index(kind) > kinds.index(self.kinds.get(column, 'int')):
+                self.kinds[column] = kind
+            else:
+                self.kinds.setdefault(column, kind)
+            np.save(os.path.join(self.path, f'{number:05d}_{i}.npy'), array)
+            stats[column] = _stats(array)
+        self.chunks.append({'rows': len(arrays[0]) if arrays else 0, 'stats': stats})
+
+    def close(self):
+        self.flush()
+        schema = {'columns': self.columns, 'kinds': {column: self.kinds.get(column, 'str') for column in self.columns},
+                  'chunks': self.chunks}
+        tmp_path = os.path.join(self.path, 'schema.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(schema, f)
+        os.replace(tmp_path, os.path.join(self.path, 'schema.json'))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_schema(path):
+    with open(os.path.join(path, 'schema.json'), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+# Whether a chunk can hold a row matching (column, operator, value), decided from its min/max only
+def _chunk_may_match(stats, operator, value):
+    if stats is None:
+        return True
+    low, high = stats
+    try:
+        if operator == '==':
+            return low <= value <= high
+        if operator == '!=':
+            return not low == high == value
+        if operator == '<':
+            return low < value
+        if operator == '<=':
+            return low <= value
+        if operator == '>':
+            return high > value
+        if operator == '>=':
+            return high >= value
+        if operator == 'in':
+            return any(low <= item <= high for item in value)
+        if operator == 'not in':
+            return not (low == high and low in value)
+    except TypeError:
+        pass
+    return True
+
+
+def _mask(array, operator, value):
+    # 'N/A' against a numeric column means the missing values
+    if array.dtype.kind == 'f' and isinstance(value, str) and value in na_values:
+        missing = np.isnan(array)
+        if operator == '==':
+            return missing
+        if operator == '!=':
+            return ~missing
+    if array.dtype.kind == 'f' and operator in ('in', 'not in'):
+        numbers = [item for item in value if not isinstance(item, str)]
+        hit = np.isin(array, numbers)
+        if any(isinstance(item, str) and item in na_values for item in value):
+            hit |= np.isnan(array)
+        return hit if operator == 'in' else ~hit
+    if operator == 'in':
+        return np.isin(array, list(value))
+    if operator == 'not in':
+        return ~np.isin(array, list(value))
+    return {'==': np.equal, '!=': np.not_equal, '<': np.less, '<=': np.less_equal,
+            '>': np.greater, '>=': np.greater_equal}[operator](array, value)
+
+
+# Chunks of a table as {column: array}. Only the requested columns are read (projection) and
+# filters [(column, operator, value), ...] (all must hold) skip chunks by their statistics before any
+# data is read, then rows by one vectorized mask (predicate pushdown). Files are memory-mapped
+def iter_chunks(path, columns=None, filters=None):
+    schema = read_schema(path)
+    positions = {column: i for i, column in enumerate(schema['columns'])}
+    columns = list(columns) if columns is not None else schema['columns']
+    filters = list(filters or [])
+    for column in columns + [column for column, _, _ in filters]:
+        if column not in positions:
+            raise KeyError(f"Column {column} is not in {path}")
+    for column, operator, _ in filters:
+        if operator not in operators:
+            raise ValueError(f"Unknown filter operator {operator}")
+
+    def load(number, column):
+        array = np.load(os.path.join(path, f'{number:05d}_{positions[column]}.npy'), mmap_mode='r')
+        return as_kind(array, schema['kinds'][column])
+
+    for number, chunk in enumerate(schema['chunks']):
+        if not all(_chunk_may_match(chunk['stats'][column], operator, value) for column, operator, value in filters):
+            continue
+        mask = None
+        for column, operator, value in filters:
+            column_mask = _mask(load(number, column), operator, value)
+            mask = column_mask if mask is None else mask & column_mask
+        if mask is not None and not mask.any():
+            continue
+        yield {column: np.asarray(load(number, column)[mask] if mask is not None else load(number, column))
+               for column in columns}
+
+
+# Whole columns of a table (the chunks concatenated)
+def read_table(path, columns=None, filters=None):
+    schema = read_schema(path)
+    columns = list(columns) if columns is not None else schema['columns']
+    parts = {column: [] for column in columns}
+    for chunk in iter_chunks(path, columns, filters):
+        for column in columns:
+            parts[column].append(chunk[column])
+    empty = {'int': np.int64, 'float': np.float64, 'str': str}
+    return {column: np.concatenate(parts[column]) if parts[column]
+            else np.array([], dtype=empty[schema['kinds'][column]]) for column in columns}
+
+
+def _text(value):
+    if isinstance(value, float):
+        if np.isnan(value):
+            return 'N/A'
+        return str(int(value)) if value.is_integer() else repr(value)
+    return str(value)
+
+
+# Rows of a table as dicts of strings, the way csv.DictReader gives them to the stage scripts
+def iter_rows(path, columns=None, filters=None):
+    for chunk in iter_chunks(path, columns, filters):
+        names = list(chunk)
+        for values in zip(*(chunk[name].tolist() for name in names)):
+            yield dict(zip(names, map(_text, values)))
+
+
+def _csv_filter(row, filters):
+    for column, operator, value in filters:
+        cell = row[column]
+        if operator in ('in', 'not in'):
+            if (cell in [str(item) for item in value]) != (operator == 'in'):
+                return False
+        elif operator in ('==', '!='):
+            if (cell == str(value)) != (operator == '=='):
+                return False
+        else:
+            try:
+                cell = float(cell)
+            except ValueError:
+                return False
+            if not _mask(np.float64(cell), operator, value):
+                return False
+    return True
+
+
+# (fieldnames, rows) of a stage input, CSV or table: the stage scripts read both the same way
+@contextlib.contextmanager
+def open_rows(path, columns=None, filters=None, encoding='utf-8'):
+    if is_table(path):
+        yield (list(columns) if columns is not None else read_schema(path)['columns']), \
+            iter_rows(path, columns, filters)
+        return
+    with open(path, mode='r', newline='', encoding=encoding) as f:
+        reader = csv.DictReader(f)
+        rows = reader
+        if filters:
+            rows = (row for row in rows if _csv_filter(row, filters))
+        if columns is not None:
+            rows = ({column: row[column] for column in columns} for row in rows)
+        yield (list(columns) if columns is not None else reader.fieldnames), rows
+
+
+# CSV rows end with LF like the datasets in data/, so a CSV -> table -> CSV round trip gives the same bytes
+class _CsvWriter:
+    def __init__(self, f, columns):
+        self._f = f
+        self._columns = columns
+        self._writer = csv.writer(f, lineterminator='\n')
+
+    def writeheader(self):
+        self._writer.writerow(self._columns)
+
+    def writerow(self, row):
+        if isinstance(row, dict):
+            row = [row.get(column, '') for column in self._columns]
+        self._writer.writerow(row)
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+
+# Writer of a stage output, CSV or table (by the path), the header is written on open
+@contextlib.contextmanager
+def open_writer(path, columns, encoding='utf-8'):
+    if is_table(path):
+        writer = TableWriter(path, columns)
+        yield writer
+        writer.close()
+        return
+    with open(path, mode='w', newline='', encoding=encoding) as f:
+        writer = _CsvWriter(f, list(columns))
+        writer.writeheader()
+        yield writer
+
+
+# Converting a CSV stage output into a table (or a table back into CSV)
+def convert(input_path, output_path, encoding='utf-8'):
+    with open_rows(input_path, encoding=encoding) as (columns, rows), open_writer(output_path, columns) as writer:
+        count = 0
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+if __name__ == "__main__":
+    # python columnar.py <input.csv> <output.table>
+    count = convert(sys.argv[1], sys.argv[2])
+    print(f"{count} rows of {sys.argv[1]} have been saved to {sys.argv[2]}.")
@@ -0,0 +1,97 @@
+from html.parser import HTMLParser
+
+# Tags counted for Link_Count, Image_Count, Video_Count, Has_Ads, H1_Count and H2_Count
+counted_tags = ('a', 'img', 'video', 'iframe', 'ins', 'ad', 'h1', 'h2')
+
+# Text of these tags is not part of BeautifulSoup's get_text(), so it is not counted as words
+hidden_text_tags = ('script', 'style', 'template', 'rt', 'rp')
+
+
+# Tags which never have content (BeautifulSoup closes them right away)
+void_tags = frozenset(['area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'menuitem',
+                       'meta', 'param', 'source', 'track', 'wbr', 'basefont', 'bgsound', 'command', 'frame', 'image',
+                       'isindex', 'nextid', 'spacer'])
+
+
+# Counting tags and words in one pass over the HTML tokens, without building a tree.
+# Word_Count is the same as len(soup.get_text().split()): text nodes are joined without separator,
+# so a word split by a tag ("foo<b>bar</b>") is one word. Only the names of the open tags are kept,
+# end tags close them the same way BeautifulSoup's html.parser builder does
+class ContentCounter(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.tag_counts = dict.fromkeys(counted_tags, 0)
+        self.word_count = 0
+        self._open_tags = []
+        self._hidden_depth = 0
+        self._in_word = False
+        # Every string of the page (also scripts and comments) for keyword matching
+        self.text_nodes = []
+        self.password_inputs = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.tag_counts:
+            self.tag_counts[tag] += 1
+        if tag == 'input':
+            self._check_password(attrs)
+        if tag not in void_tags:
+            self._open_tags.append(tag)
+            if tag in hidden_text_tags:
+                self._hidden_depth += 1
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in self.tag_counts:
+            self.tag_counts[tag] += 1
+        if tag == 'input':
+            self._check_password(attrs)
+
+    def _check_password(self, attrs):
+        if ('type', 'password') in attrs:
+            self.password_inputs += 1
+
+    # Closing the most recent open tag with this name and everything opened after it
+    def handle_endtag(self, tag):
+        if tag not in self._open_tags:
+            return
+        while True:
+            closed = self._open_tags.pop()
+            if closed in hidden_text_tags:
+                self._hidden_depth -= 1
+            if closed == tag:
+                break
+
+    def handle_data(self, data):
+        self.text_nodes.append(data)
+        if not self._hidden_depth:
+            self._count_words(data)
+
+    def handle_comment(self, data):
+        self.text_nodes.append(data)
+
+    def handle_decl(self, data):
+        self.text_nodes.append(data[8:] if data.startswith('DOCTYPE ') else data)
+
+    def handle_pi(self, data):
+        self.text_nodes.append(data)
+
+    def unknown_decl(self, data):
+        if data.startswith('CDATA['):
+            self.text_nodes.append(data[6:])
+            self._count_words(data[6:])
+
+    def _count_words(self, text):
+        if not text:
+            return
+        words = len(text.split())
+        # The first word continues the previous text node
+        if words and self._in_word and not text[0].isspace():
+            words -= 1
+        self.word_count += words
+        self._in_word = not text[-1].isspace()
+
+
+def count_content(html):
+    counter = ContentCounter()
+    counter.feed(html)
+    counter.close()
+    return counter
@@ -0,0 +1,84 @@
+import threading
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
+
+# Headers sent with every request
+DEFAULT_HEADERS = {'User-Agent': USER_AGENT}
+
+# Pool limits: kept-alive host pools, connections per host and connections in use at the same time
+pool_hosts = 1000
+pool_size_per_host = 4
+max_total_connections = 200
+
+_lock = threading.Lock()
+_local = threading.local()
+_adapter = None
+_total_slots = None
+
+
+# Changing the pool limits (must be called before the first request)
+def configure(hosts=None, per_host=None, max_total=None):
+    global pool_hosts, pool_size_per_host, max_total_connections, _adapter, _total_slots
+    with _lock:
+        if _adapter is not None:
+            raise RuntimeError("HTTP pool is already in use, configure it before the first request")
+        pool_hosts = hosts or pool_hosts
+        pool_size_per_host = per_host or pool_size_per_host
+        max_total_connections = max_total or max_total_connections
+
+
+# One adapter (urllib3 pool manager) shared by all threads, blocking when a host's pool is exhausted
+def _shared_adapter():
+    global _adapter, _total_slots
+    with _lock:
+        if _adapter is None:
+            _adapter = HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_size_per_host, pool_block=True)
+            _total_slots = threading.BoundedSemaphore(max_total_connections)
+        return _adapter
+
+
+# Each thread gets its own Session object on top of the shared pool, so no session state is shared
+def get_session():
+    session = getattr(_local, 'session', None)
+    if session is None:
+        adapter = _shared_adapter()
+        session = requests.Session()
+        session.headers.update(DEFAULT_HEADERS)
+        # Cookies are not sent back, every page is requested like a first visit (Cookies_Present feature)
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _local.session = session
+    return session
+
+
+# Drop-in replacement for requests.get which reuses kept-alive connections. A connection slot is held until
+# the body has been read: right away without stream=True, when the response is closed with it
+def get(url, **kwargs):
+    session = get_session()
+    _total_slots.acquire()
+    try:
+        response = session.get(url, **kwargs)
+    except BaseException:
+        _total_slots.release()
+        raise
+    if not kwargs.get('stream'):
+        _total_slots.release()
+        return response
+
+    close = response.close
+    released = threading.Lock()
+
+    def close_and_release():
+        try:
+            close()
+        finally:
+            if released.acquire(blocking=False):
+                _total_slots.release()
+
+    response.close = close_and_release
+    return response
@@ -0,0 +1,145 @@
+import time
+
+import requests
+from bs4 import BeautifulSoup
+from requests.compat import chardet
+
+import http_session
+from content_counter import count_content
+
+# Bodies are read in chunks and cut at max_body_bytes, pages are almost never bigger
+max_body_bytes = 2 * 1024 ** 2
+chunk_bytes = 64 * 1024
+
+# Bodies of other content types are not downloaded at all (a missing Content-Type is allowed)
+html_content_types = ('text/html', 'application/xhtml+xml')
+
+
+# The answer is not a page (e.g. a PDF, an image or a file download), its body was not read.
+# The headers of the answer are kept for header-only features
+class UnwantedContentError(requests.exceptions.RequestException):
+    def __init__(self, message, headers=None):
+        super().__init__(message)
+        self.headers = headers
+
+
+# Checking the Content-Type header before anything of the body is read. Only 2xx answers are filtered:
+# error and throttling answers (e.g. a text/plain 429) are kept so their status and Retry-After are seen
+def check_content_type(url, headers, content_types=html_content_types, status=200):
+    if content_types is None or not 200 <= status < 300:
+        return
+    content_type = headers.get('Content-Type', '').split(';')[0].strip().lower()
+    if content_type and content_type not in content_types:
+        raise UnwantedContentError(f"Skipped {content_type} body of {url}", headers)
+
+
+# One downloaded page which is shared by all feature extractors (fetched once, parsed once)
+class PageSnapshot:
+    def __init__(self, url, status_code, headers, content, encoding=None):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.encoding = encoding
+        self._text = None
+        self._soup = None
+        self._counts = None
+        self._keyword_hits = {}
+
+    # Only the raw page is pickled (e.g. when it is sent to a parse process), parsed state is rebuilt there
+    def __getstate__(self):
+        return {'url': self.url, 'status_code': self.status_code, 'headers': self.headers,
+                'content': self.content, 'encoding': self.encoding}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    @classmethod
+    def from_response(cls, response):
+        encoding = response.encoding or response.apparent_encoding
+        return cls(response.url, response.status_code, response.headers, response.content, encoding)
+
+    # Reading a stream=True response: at most max_bytes of the body within read_timeout seconds.
+    # The connection is closed when the body is cut, so the rest is never downloaded
+    @classmethod
+    def from_stream(cls, response, max_bytes=max_body_bytes, read_timeout=None):
+        deadline = time.monotonic() + read_timeout if read_timeout else None
+        chunks = []
+        size = 0
+        try:
+            for chunk in response.iter_content(chunk_bytes):
+                chunks.append(chunk)
+                size += len(chunk)
+                if size >= max_bytes:
+                    break
+                if deadline is not None and time.monotonic() > deadline:
+                    raise requests.exceptions.ReadTimeout(f"Body of {response.url} took longer than {read_timeout}s")
+        finally:
+            response.close()
+        content = b''.join(chunks)[:max_bytes]
+        encoding = response.encoding or chardet.detect(content)['encoding']
+        return cls(response.url, response.status_code, response.headers, content, encoding)
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error for url: {self.url}")
+
+    # Decoding the body only once (same fallback as requests' response.text)
+    @property
+    def text(self):
+        if self._text is None:
+            try:
+                self._text = str(self.content, self.encoding or 'utf-8', errors='replace')
+            except (LookupError, TypeError):
+                self._text = str(self.content, errors='replace')
+        return self._text
+
+    # Parsing the body only on first access
+    @property
+    def soup(self):
+        if self._soup is None:
+            self._soup = BeautifulSoup(self.text, 'html.parser')
+        return self._soup
+
+    # Tag and word counts from one streaming pass over the body (no tree is built)
+    @property
+    def counts(self):
+        if self._counts is None:
+            self._counts = count_content(self.text)
+        return self._counts
+
+    # Keyword hit counts of a KeywordMatcher, the page text is scanned once per matcher
+    def keyword_hits(self, matcher):
+        hits = self._keyword_hits.get(matcher)
+        if hits is None:
+            hits = self._keyword_hits[matcher] = matcher.count(self.counts.text_nodes)
+        return hits
+
+
+# Downloading the page one time for every feature of the row (over the shared keep-alive pool),
+# a PageCache is consulted first and filled afterwards when given. The body is streamed: other content
+# types are rejected from the headers, big bodies are cut at max_bytes and reading it may take at most
+# `timeout` seconds in total (requests' own timeout is per socket read)
+def fetch_snapshot(url, timeout=12, headers=None, cache=None, throttle=None, max_bytes=max_body_bytes,
+                   content_types=html_content_types, **kwargs):
+    if cache is not None:
+        snapshot = cache.lookup(url)
+        if snapshot is not None:
+            return snapshot
+    # throttle (politeness.HostThrottle) adds per-host limits and retries of throttled requests
+    get = throttle.get if throttle is not None else http_session.get
+    response = get(url, headers=headers, timeout=timeout, stream=True, **kwargs)
+    try:
+        check_content_type(url, response.headers, content_types, response.status_code)
+    except UnwantedContentError:
+        response.close()
+        raise
+    snapshot = PageSnapshot.from_stream(response, max_bytes, read_timeout=timeout)
+    if cache is not None:
+        cache.put(url, snapshot)
+    return snapshot
+
@@ -0,0 +1,116 @@
+import json
+import sqlite3
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+index_file = '../data/url_index.sqlite'
+
+# Query parameters which only track the visitor, they never change the page
+tracking_params = frozenset(['gclid', 'gclsrc', 'dclid', 'fbclid', 'msclkid', 'yclid', 'igshid', 'mc_cid', 'mc_eid',
+                             '_ga', '_gl', 'ref_src', 'spm', 'srsltid', 'wickedid', '_hsenc', '_hsmi', 'mkt_tok'])
+tracking_prefixes = ('utm_', 'pk_', 'hsa_')
+
+
+def is_tracking_param(name):
+    name = name.lower()
+    return name in tracking_params or name.startswith(tracking_prefixes)
+
+
+# One key per page: http/https, "www.", default ports, letter case of the host, fragments, tracking
+# parameters, parameter order and a trailing slash do not make a different page.
+# Bare domains of the blacklists ("example.com") become https://example.com/
+def canonical_url(url):
+    url = url.strip()
+    parts = urlsplit(url if '//' in url else '//' + url)
+    host = (parts.hostname or '').rstrip('.')
+    try:
+        host = host.encode('idna').decode('ascii')
+    except UnicodeError:
+        pass
+    if host.startswith('www.'):
+        host = host[4:]
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if port and port not in (80, 443):
+        host = f"{host}:{port}"
+    path = parts.path or '/'
+    if len(path) > 1 and path.endswith('/'):
+        path = path.rstrip('/') or '/'
+    query = urlencode(sorted((name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+                             if not is_tracking_param(name)))
+    return urlunsplit(('https', host, path, query, ''))
+
+
+# Index of canonical URLs shared by the collectors and the crawl scripts:
+# - every canonical URL with all categories (and sources) it was found under (many-to-many)
+# - one record per canonical URL and stage (e.g. the metadata or content features of the page), so a page
+#   found again under another category or in a later run is not downloaded and analyzed again
+# A run id tells whether a URL was already seen in this run, the collectors write every page only once
+class UrlIndex:
+    def __init__(self, path=index_file, run=None, ttl=30 * 24 * 3600, commit_every=1000):
+        self.run = run or time.strftime('%Y%m%d%H%M%S')
+        self.ttl = ttl
+        self.commit_every = commit_every
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS urls (canonical TEXT PRIMARY KEY, url TEXT, run TEXT, '
+                         'first_seen REAL)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS categories (canonical TEXT, category TEXT, source TEXT, '
+                         'PRIMARY KEY (canonical, category))')
+        self._db.execute('CREATE TABLE IF NOT EXISTS records (canonical TEXT, stage TEXT, data TEXT, '
+                         'updated_at REAL, PRIMARY KEY (canonical, stage))')
+        self._db.commit()
+
+    # Recording url under category, (canonical url, True when it is the first time in this run)
+    def add(self, url, category=None, source=None):
+        canonical = canonical_url(url)
+        with self._lock:
+            row = self._db.execute('SELECT run FROM urls WHERE canonical = ?', (canonical,)).fetchone()
+            if row is None:
+                self._db.execute('INSERT INTO urls VALUES (?, ?, ?, ?)', (canonical, url, self.run, time.time()))
+            elif row[0] != self.run:
+                self._db.execute('UPDATE urls SET run = ? WHERE canonical = ?', (self.run, canonical))
+            if category is not None:
+                self._db.execute('INSERT OR IGNORE INTO categories VALUES (?, ?, ?)', (canonical, category, source))
+            self._wrote()
+        return canonical, row is None or row[0] != self.run
+
+    def categories(self, url):
+        with self._lock:
+            rows = self._db.execute('SELECT category FROM categories WHERE canonical = ? ORDER BY category',
+                                    (canonical_url(url),)).fetchall()
+        return [row[0] for row in rows]
+
+    # (True, data) for a fresh record of the page (data is None when the page was skipped), (False, None) otherwise
+    def get_record(self, url, stage):
+        with self._lock:
+            row = self._db.execute('SELECT data, updated_at FROM records WHERE canonical = ? AND stage = ?',
+                                   (canonical_url(url), stage)).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return False, None
+        return True, json.loads(row[0])
+
+    def put_record(self, url, stage, data):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?)',
+                             (canonical_url(url), stage, json.dumps(data), time.time()))
+            self._wrote()
+
+    def _wrote(self):
+        self._writes += 1
+        if self._writes % self.commit_every == 0:
+            self._db.commit()
+
+    def commit(self):
+        with self._lock:
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.commit()
+            self._db.close()
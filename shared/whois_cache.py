@@ -0,0 +1,135 @@
+import concurrent.futures
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import tldextract
+import whois
+import whois.parser
+
+# Public suffix list shipped with tldextract (no download at start-up)
+_extract = tldextract.TLDExtract(suffix_list_urls=())
+
+# Definitive answers without a creation date: the registry has no record of the domain or its date can not be
+# read (older python-whois versions raise PywhoisError for both). Only these are cached as failures
+no_record_errors = tuple(getattr(whois.parser, name) for name in
+                         ('WhoisDomainNotFoundError', 'WhoisUnknownDateFormatError', 'PywhoisError')
+                         if hasattr(whois.parser, name))
+
+
+# Registered domain (eTLD+1) of a URL or host: shop.example.co.uk/path -> example.co.uk
+def registered_domain(url):
+    host = urlsplit(url if '//' in url else '//' + url).hostname or url
+    parts = _extract(host)
+    if parts.domain and parts.suffix:
+        return f"{parts.domain}.{parts.suffix}"
+    return parts.domain or host
+
+
+# Creation date of a domain from a live WHOIS query (None when the registry does not give one)
+def lookup_creation_date(domain):
+    creation_date = whois.whois(domain).creation_date
+    if isinstance(creation_date, list):
+        creation_date = creation_date[0]
+    if not isinstance(creation_date, datetime):
+        return None
+    # Naive local time, like datetime.now() which the age is computed with
+    if creation_date.tzinfo is not None:
+        creation_date = creation_date.astimezone().replace(tzinfo=None)
+    return creation_date
+
+
+# Persistent WHOIS results per registered domain, domains without a record are cached for a shorter time
+class WhoisCache:
+    def __init__(self, path, ttl=180 * 24 * 3600, negative_ttl=24 * 3600):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS whois (domain TEXT PRIMARY KEY, creation_date TEXT, '
+                         'fetched_at REAL)')
+        self._db.commit()
+
+    # (True, creation date or None) for a fresh entry, (False, None) when the domain must be looked up
+    def get(self, domain):
+        with self._lock:
+            row = self._db.execute('SELECT creation_date, fetched_at FROM whois WHERE domain = ?',
+                                   (domain,)).fetchone()
+        if row is None:
+            return False, None
+        creation_date, fetched_at = row
+        ttl = self.ttl if creation_date else self.negative_ttl
+        if time.time() - fetched_at > ttl:
+            return False, None
+        return True, datetime.fromisoformat(creation_date) if creation_date else None
+
+    def put(self, domain, creation_date):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO whois VALUES (?, ?, ?)',
+                             (domain, creation_date.isoformat() if creation_date else None, time.time()))
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+# Separate worker lane for WHOIS: a few threads, a global request rate and one query per registered
+# domain at a time, so slow or throttled WHOIS servers never hold the page download workers
+class WhoisLane:
+    def __init__(self, cache, workers=4, rate=2.0, logger=None):
+        self.cache = cache
+        self.interval = 1.0 / rate
+        self.logger = logger
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='whois')
+        self._lock = threading.Lock()
+        self._next_start = 0.0
+        self._in_flight = {}
+
+    # Future of the creation date of the url's registered domain
+    def submit(self, url):
+        domain = registered_domain(url)
+        hit, creation_date = self.cache.get(domain)
+        if hit:
+            future = concurrent.futures.Future()
+            future.set_result(creation_date)
+            return future
+        with self._lock:
+            future = self._in_flight.get(domain)
+            if future is None:
+                future = self._in_flight[domain] = self._executor.submit(self._lookup, domain)
+        return future
+
+    def _wait_for_turn(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+    def _lookup(self, domain):
+        try:
+            self._wait_for_turn()
+            try:
+                creation_date = lookup_creation_date(domain)
+            except no_record_errors:
+                creation_date = None
+            except Exception as e:
+                # Timeouts, refused or reset connections and rate limits: not cached, a later lookup tries again
+                if self.logger:
+                    self.logger.error(f"WHOIS exception for {domain}: {e}")
+                else:
+                    print(f"WHOIS exception for {domain}: {e}")
+                return None
+            self.cache.put(domain, creation_date)
+            return creation_date
+        finally:
+            with self._lock:
+                self._in_flight.pop(domain, None)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)